@@ -0,0 +1,177 @@
+from aiogram.fsm.state import StatesGroup, State
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from quiz import DEFAULT_QUIZ_ID
+
+
+# Состояние админа, пока он пишет ответ пользователю
+class AdminReply(StatesGroup):
+    Writing = State()
+
+
+# Фильтры просмотра: ключ в callback_data -> статус для хранилища
+FILTERS = {
+    "all": None,
+    "pending": "pending",
+    "answered": "answered",
+    "review": "review"
+}
+
+FILTER_TITLES = {
+    "all": "📋 Все",
+    "pending": "⏳ Ждут ответа",
+    "answered": "💬 С ответом",
+    "review": "🔎 На проверку"
+}
+
+# Ограничение длины ответа в списке, чтобы страница влезла в одно сообщение
+MAX_ANSWER_LENGTH = 300
+
+# Лимит Telegram - 4096 символов (UTF-16) после разбора разметки; запас на эмодзи
+MAX_MESSAGE_LENGTH = 4000
+
+
+# Экранирование для ParseMode.MARKDOWN (ответы и username приходят от пользователей)
+def escape_md(text):
+    text = str(text)
+    for char in ('\\', '_', '*', '`', '['):
+        text = text.replace(char, '\\' + char)
+    return text
+
+
+# anchor - ключ соседней страницы: ("a", ключ) - следующая после него, ("b", ключ) - предыдущая до него
+def page_callback(status_key, page, anchor=None):
+    data = f"admin_page_{status_key}_{page}"
+    if anchor is not None:
+        data += f"_{anchor[0]}{anchor[1]}"
+    return data
+
+
+# "admin_page_pending_3_a1520" -> ("pending", 3, ("a", 1520)); без ключа - anchor None
+def parse_page_callback(data):
+    status_key, page, *anchor = data[len("admin_page_"):].split('_')
+    if status_key not in FILTERS:
+        status_key = "all"
+    if anchor and anchor[0][:1] in ("a", "b") and anchor[0][1:].isdigit():
+        anchor = (anchor[0][0], int(anchor[0][1:]))
+    else:
+        anchor = None
+    return status_key, max(int(page), 0), anchor
+
+
+# Ответ, обрезанный так, чтобы после экранирования занимал не больше limit символов
+def _fit_answer(answer, limit):
+    cut = answer[:limit]
+    # Экранированный символ занимает два - отрезаем по половине превышения, пока не влезет
+    while len(escape_md(cut)) > limit:
+        cut = cut[:len(cut) - (len(escape_md(cut)) - limit + 1) // 2]
+    return escape_md(cut)
+
+
+# Карточка последней отправки пользователя (не длиннее max_length: хвост ответов обрезается)
+def format_entry(user_id, entry, max_answer_length=None, max_length=MAX_MESSAGE_LENGTH):
+    text = f"**📋 Ответ пользователя {user_id}**\n"
+    text += f"**Пользователь:** @{escape_md(entry['username'])}\n"
+    text += f"**Время:** {entry['timestamp']}\n"
+    if entry.get('quiz_id') not in (None, DEFAULT_QUIZ_ID):
+        text += f"**Тест:** {escape_md(entry['quiz_id'])}\n"
+    if entry.get('admin_response'):
+        text += "**Статус:** 💬 отвечено\n"
+    score = entry.get('score')
+    if score:
+        text += f"**Балл:** {score['total'] * 100:.0f}%"
+        text += " — 🔎 на проверку\n" if score.get('review') else "\n"
+    text += "\n"
+
+    answers = list(entry['answers'].items())
+    for i, (q_num, answer) in enumerate(answers):
+        answer = str(answer)
+        if max_answer_length and len(answer) > max_answer_length:
+            answer = answer[:max_answer_length] + "…"
+        question_score = score['questions'].get(q_num) if score else None
+        mark = f" _({question_score * 100:.0f}%)_" if question_score is not None else ""
+        prefix = f"**Вопрос {q_num}:**{mark} "
+        block = prefix + escape_md(answer) + "\n\n"
+        omitted = f"✂️ Не поместилось ответов: {len(answers) - i}\n"
+        if len(text) + len(block) > max_length - len(omitted):
+            room = max_length - len(omitted) - len(text) - len(prefix) - len("…\n\n")
+            if room >= 50:
+                text += prefix + _fit_answer(answer, room) + "…\n\n"
+                omitted = f"✂️ Не поместилось ответов: {len(answers) - i - 1}\n" if i + 1 < len(answers) else ""
+            return text + omitted
+        text += block
+    return text
+
+
+def respond_button(user_id, entry):
+    return InlineKeyboardButton(
+        text=f"💬 Ответить @{entry['username']}",
+        callback_data=f"respond_{user_id}"
+    )
+
+
+NEXT_PENDING_BUTTON = InlineKeyboardButton(text="⏳ Следующий без ответа", callback_data="admin_next_pending")
+
+reply_cancel_keyboard = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="✖️ Отмена", callback_data="reply_cancel")]]
+)
+
+
+# Страница браузера ответов: (текст, клавиатура)
+# Листание идёт от ключа соседней страницы (anchor), чтобы хранилище не пропускало offset строк
+async def render_page(store, status_key="all", page=0, page_size=3, anchor=None):
+    status = FILTERS[status_key]
+    items = None
+    if anchor is not None:
+        direction, key = anchor
+        total, items, keys = await store.latest_page(
+            page * page_size, page_size, status=status,
+            after=key if direction == "a" else None, before=key if direction == "b" else None
+        )
+        if direction == "b" and len(items) < page_size:
+            # До ключа меньше целой страницы - значит, это начало списка
+            items = None
+            page = 0
+    if not items:
+        total, items, keys = await store.latest_page(page * page_size, page_size, status=status)
+    pages = max((total + page_size - 1) // page_size, 1)
+
+    if not items and page > 0:
+        # Страница могла исчезнуть (например, после ответа админа) - показываем последнюю
+        page = pages - 1
+        total, items, keys = await store.latest_page(page * page_size, page_size, status=status)
+    page = min(page, pages - 1)
+
+    if not items:
+        text = f"**{FILTER_TITLES[status_key]}**\n\n📋 Пока нет ответов."
+    else:
+        text = f"**{FILTER_TITLES[status_key]}** — страница {page + 1} из {pages} (всего: {total})\n\n"
+        # Место делится поровну между карточками, чтобы страница осталась одним сообщением
+        per_entry = (MAX_MESSAGE_LENGTH - len(text)) // len(items) - 1
+        text += "\n".join(
+            format_entry(user_id, entry, MAX_ANSWER_LENGTH, max_length=per_entry) for user_id, entry in items
+        )
+
+    keyboard = [[respond_button(user_id, entry)] for user_id, entry in items]
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️", callback_data=page_callback(status_key, page - 1, keys and ("b", keys[0]))
+        ))
+    navigation.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="admin_noop"))
+    if page + 1 < pages:
+        navigation.append(InlineKeyboardButton(
+            text="➡️", callback_data=page_callback(status_key, page + 1, keys and ("a", keys[1]))
+        ))
+    keyboard.append(navigation)
+
+    keyboard.append([
+        InlineKeyboardButton(
+            text=("• " if key == status_key else "") + title,
+            callback_data=page_callback(key, 0)
+        )
+        for key, title in FILTER_TITLES.items()
+    ])
+
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+from metrics import updates_dropped_total
+from outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+# Ограниченный LRU-набор ключей со сроком жизни
+class ExpiringSet:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    # Добавить ключ; True, если он уже был и ещё не истёк
+    def seen(self, key, ttl, now):
+        expires = self.items.get(key)
+        if expires is not None and expires > now:
+            return True
+        self.items[key] = now + ttl
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return False
+
+
+# Внешний middleware на dp.update: лимит частоты, дубли callback и последовательная обработка пользователя
+class AntiFloodMiddleware(BaseMiddleware):
+    """Обновления одного пользователя идут по очереди, разные пользователи - параллельно"""
+
+    def __init__(self, rate=3, burst=10, callback_ttl=60, double_tap_ttl=2, warn_interval=10,
+                 max_users=10000, exempt_user_ids=(), navigation_prefixes=()):
+        # rate=0 выключает лимит частоты (дубли и блокировка остаются)
+        self.rate = rate
+        self.burst = burst
+        # Повторная доставка того же callback (по id) и двойное нажатие той же кнопки (по сообщению и data)
+        self.callback_ttl = callback_ttl
+        self.double_tap_ttl = double_tap_ttl
+        # Кнопки листания (data с этими префиксами) жмут подряд намеренно: "вперёд-назад" даёт ту же
+        # data на том же сообщении, так что для них проверяется только повторная доставка по id
+        self.navigation_prefixes = tuple(navigation_prefixes)
+        self.warn_interval = warn_interval
+        self.max_users = max_users
+        self.exempt_user_ids = set(exempt_user_ids)
+        self.buckets = OrderedDict()
+        self.warned = {}
+        self.callbacks = ExpiringSet(max_users)
+        # user_id -> [Lock, число ожидающих]; запись удаляется, когда пользователя никто не ждёт
+        self.locks = {}
+
+    def _allow(self, user_id, now):
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user_id)
+        return bucket.try_take(now)
+
+    def _is_duplicate(self, callback, now):
+        if self.callbacks.seen(("id", callback.id), self.callback_ttl, now):
+            return True
+        if callback.message is None or (callback.data or "").startswith(self.navigation_prefixes):
+            return False
+        key = ("tap", callback.from_user.id, callback.message.message_id, callback.data)
+        return self.callbacks.seen(key, self.double_tap_ttl, now)
+
+    async def _reject(self, event, user_id, reason, now):
+        updates_dropped_total.inc(reason)
+        try:
+            if event.callback_query is not None:
+                # Иначе у пользователя будут "часики" на кнопке
+                await event.callback_query.answer("⏳ Слишком часто" if reason == "flood" else None)
+            elif event.message is not None and reason == "flood":
+                if now - self.warned.get(user_id, 0) >= self.warn_interval:
+                    if len(self.warned) >= self.max_users:
+                        self.warned = {uid: at for uid, at in self.warned.items() if now - at < self.warn_interval}
+                    self.warned[user_id] = now
+                    await event.message.answer("⏳ Слишком много сообщений, подождите немного.")
+        except Exception as e:
+            logger.warning(f"Не удалось ответить на отброшенное обновление: {e}")
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        user_id = user.id
+        now = time.monotonic()
+        if event.callback_query is not None and self._is_duplicate(event.callback_query, now):
+            await self._reject(event, user_id, "duplicate", now)
+            return None
+        if self.rate and user_id not in self.exempt_user_ids and not self._allow(user_id, now):
+            await self._reject(event, user_id, "flood", now)
+            return None
+
+        slot = self.locks.get(user_id)
+        if slot is None:
+            slot = self.locks[user_id] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                return await handler(event, data)
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self.locks[user_id]
@@ -0,0 +1,203 @@
+"""Нагрузочный прогон: тысячи синтетических пользователей проходят тест одновременно.
+
+Каждый пользователь - отдельная задача со своей последовательностью обновлений:
+старт теста, текстовые ответы с подтверждением (иногда сначала "Нет"), варианты,
+часть пользователей отменяет тест на середине. Сеть не используется: сессия бота
+подменена FakeSession, а исходящий планировщик с лимитами Telegram не участвует.
+
+Запуск:
+    python benchmarks/bench_load.py                      # сравнить с baseline_load.json
+    python benchmarks/bench_load.py --save               # записать новый baseline
+    python benchmarks/bench_load.py --fsm sqlite --store sqlite --users 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from fake_telegram import ROOT, FakeSession, UpdateFactory
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline_load.json')
+CANCEL_SHARE = 0.1
+CONFIRM_NO_SHARE = 0.2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000, help="число синтетических пользователей")
+    parser.add_argument('--concurrency', type=int, default=500, help="сколько пользователей активны одновременно")
+    parser.add_argument('--fsm', default='memory', choices=('memory', 'sqlite'), help="FSM_STORAGE")
+    parser.add_argument('--store', default='file', choices=('file', 'sqlite'), help="STORAGE_BACKEND")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', action='store_true', help="сохранить результат как baseline")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    return parser.parse_args()
+
+
+# Сценарий одного пользователя: [(вид шага, обновление), ...]
+def user_script(quiz, updates, user_id, rng):
+    steps = [("start", updates.message(user_id, "🧪 Начать тестирование"))]
+    cancel_at = rng.randint(1, quiz.total) if rng.random() < CANCEL_SHARE else None
+
+    for num in range(1, quiz.total + 1):
+        if num == cancel_at:
+            if rng.random() < 0.5:
+                steps.append(("cancel", updates.callback(user_id, "cancel_test")))
+            else:
+                steps.append(("cancel", updates.message(user_id, "❌ Отмена теста")))
+            return steps
+
+        question = quiz.question(num)
+        if question.get('type') == 'choice':
+            option = rng.randrange(len(question['options']))
+            steps.append(("choice", updates.callback(user_id, f"answer_{num}_{option}")))
+            continue
+
+        if rng.random() < CONFIRM_NO_SHARE:
+            steps.append(("text", updates.message(user_id, f"черновик ответа {num}")))
+            steps.append(("confirm_no", updates.callback(user_id, "confirm_no")))
+        steps.append(("text", updates.message(user_id, f"ответ пользователя {user_id} на вопрос {num}")))
+        steps.append(("confirm_yes", updates.callback(user_id, "confirm_yes")))
+    return steps
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(share * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0
+    }
+
+
+def max_rss_mb():
+    # ru_maxrss в Linux - килобайты, в macOS - байты
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+async def run(args):
+    import bot
+
+    session = FakeSession()
+    bot.bot.session = session
+    os.chdir(tempfile.mkdtemp())
+    await bot.dp.emit_startup(bot=bot.bot)
+
+    quiz = bot.config.quiz
+    updates = UpdateFactory()
+    rng = random.Random(args.seed)
+    scripts = [user_script(quiz, updates, user_id, rng) for user_id in range(1, args.users + 1)]
+
+    latencies = defaultdict(list)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    feed = bot.dp.feed_update
+
+    async def play(script):
+        async with semaphore:
+            for kind, update in script:
+                started = time.perf_counter()
+                await feed(bot.bot, update)
+                latencies[kind].append(time.perf_counter() - started)
+
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(play(script) for script in scripts))
+    elapsed = time.perf_counter() - started
+
+    # Остановка дописывает очередь записи - это тоже часть стоимости
+    drain_started = time.perf_counter()
+    await bot.dp.emit_shutdown(bot=bot.bot)
+    drain = time.perf_counter() - drain_started
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "fsm": args.fsm,
+            "store": args.store,
+            "questions": quiz.total,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform()
+        },
+        "updates": total,
+        "api_requests": session.requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(total / elapsed, 1),
+        "drain_s": round(drain, 3),
+        "latency": summarize([value for values in latencies.values() for value in values]),
+        "latency_by_step": {kind: summarize(values) for kind, values in sorted(latencies.items())},
+        "max_rss_mb": max_rss_mb(),
+        "rss_growth_mb": round(max_rss_mb() - rss_before, 1)
+    }
+
+
+def print_report(result, baseline=None):
+    def delta(value, old):
+        if not old:
+            return ""
+        return f" ({(value - old) / old * 100:+.1f}% к baseline)"
+
+    base = baseline or {}
+    print(f"Конфигурация: {result['config']}")
+    print(f"Обновлений: {result['updates']}, запросов к API: {result['api_requests']}")
+    print(f"Время: {result['elapsed_s']} с, дописывание очереди: {result['drain_s']} с")
+    print(f"Пропускная способность: {result['throughput_ups']} обн/с"
+          f"{delta(result['throughput_ups'], base.get('throughput_ups'))}")
+    latency, base_latency = result['latency'], base.get('latency', {})
+    print(f"Задержка: p50 {latency['p50_ms']} мс{delta(latency['p50_ms'], base_latency.get('p50_ms'))}, "
+          f"p99 {latency['p99_ms']} мс{delta(latency['p99_ms'], base_latency.get('p99_ms'))}, "
+          f"max {latency['max_ms']} мс")
+    print(f"{'шаг':>12} {'кол-во':>8} {'p50, мс':>9} {'p99, мс':>9}")
+    for kind, stats in result['latency_by_step'].items():
+        print(f"{kind:>12} {stats['count']:>8} {stats['p50_ms']:>9} {stats['p99_ms']:>9}")
+    print(f"Память: max RSS {result['max_rss_mb']} МБ, прирост за прогон {result['rss_growth_mb']} МБ"
+          f"{delta(result['max_rss_mb'], base.get('max_rss_mb'))}")
+
+
+def main():
+    args = parse_args()
+    # Настройки читаются при импорте bot, поэтому задаются до него
+    os.environ['FSM_STORAGE'] = args.fsm
+    os.environ['STORAGE_BACKEND'] = args.store
+    os.environ['METRICS_PORT'] = '0'
+    os.environ['MEDIA_PREWARM'] = '0'
+    os.chdir(ROOT)
+    logging.disable(logging.CRITICAL)
+
+    result = asyncio.run(run(args))
+
+    baseline = None
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config', {}) != result['config']:
+            print("⚠️ Baseline снят с другой конфигурацией, сравнение приблизительное")
+    print_report(result, baseline)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Baseline сохранён в {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
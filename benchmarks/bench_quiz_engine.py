@@ -0,0 +1,62 @@
+"""Стоимость одного обновления в зависимости от числа вопросов в тесте.
+
+Запуск: python benchmarks/bench_quiz_engine.py
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from fake_telegram import ROOT, FakeSession, UpdateFactory
+
+os.chdir(ROOT)
+# Один пользователь отвечает на сотни вопросов подряд - анти-флуд здесь только мешает
+os.environ.setdefault('FLOOD_RATE', '0')
+import bot  # noqa: E402
+
+QUESTION_COUNTS = (3, 30, 300, 1000)
+USERS = 20
+
+
+def synthetic_questions(count):
+    return [
+        {"id": i, "type": "choice", "text": f"Вопрос {i}", "options": ["A", "B", "C"]}
+        for i in range(1, count + 1)
+    ]
+
+
+async def run(count):
+    bot.config.set_questions(synthetic_questions(count))
+    updates = UpdateFactory()
+    feed = bot.dp.feed_update
+
+    elapsed = 0.0
+    processed = 0
+    for user_id in range(1, USERS + 1):
+        batch = [updates.message(user_id, "🧪 Начать тестирование")]
+        batch += [updates.callback(user_id, f"answer_{num}_0") for num in range(1, count + 1)]
+        started = time.perf_counter()
+        for update in batch:
+            await feed(bot.bot, update)
+        elapsed += time.perf_counter() - started
+        processed += len(batch)
+    return processed, elapsed
+
+
+async def main():
+    logging.disable(logging.CRITICAL)
+    bot.bot.session = FakeSession()
+    os.chdir(tempfile.mkdtemp())
+    await bot.dp.emit_startup(bot=bot.bot)
+
+    print(f"{'вопросов':>10} {'обновлений':>12} {'мкс/обновление':>16}")
+    for count in QUESTION_COUNTS:
+        processed, elapsed = await run(count)
+        print(f"{count:>10} {processed:>12} {elapsed / processed * 1e6:>16.1f}")
+
+    await bot.dp.emit_shutdown(bot=bot.bot)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+"""Подготовка вопроса к отправке: сборка на каждый запрос против предкомпилированного кэша.
+
+Запуск: python benchmarks/bench_render.py
+"""
+import json
+import os
+import timeit
+
+from fake_telegram import ROOT
+
+from quiz import Quiz, build_question_keyboard
+
+ROUNDS = 20000
+
+
+def main():
+    os.chdir(ROOT)
+    with open('questions.json', 'r', encoding='utf-8') as f:
+        questions = json.load(f)['questions']
+    quiz = Quiz(questions)
+
+    # Как было раньше: индекс, f-строка, новая клавиатура и проверка файла на каждую отправку
+    def build_every_time():
+        for num, q in enumerate(questions, start=1):
+            keyboard = build_question_keyboard(num, q)
+            text = f"**Вопрос {num} из {len(questions)}**\n\n{q['text']}"
+            image_path = q.get('image', '')
+            image = image_path if image_path and os.path.isfile(image_path) else None
+
+    def cached():
+        for num in range(1, quiz.total + 1):
+            render = quiz.render(num)
+
+    sends = ROUNDS * len(questions)
+    for name, func in (("сборка каждый раз", build_every_time), ("кэш рендера", cached)):
+        seconds = timeit.timeit(func, number=ROUNDS)
+        print(f"{name:>20}: {seconds / sends * 1e6:8.2f} мкс на вопрос")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Холодный старт: время импорта и задержка ответа на первое обновление.
+
+Каждый прогон - новый процесс: импорт aiogram, импорт bot.py (свои модули и настройка),
+on_startup и первое обновление /start до отправки ответа. Сеть не используется.
+Результат сравнивается с бюджетом на то, что зависит от нас (всё, кроме импорта aiogram).
+
+Запуск:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --submissions 50000 --store sqlite
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# fake_telegram здесь не импортируем: он тянет aiogram, а импорт aiogram - отдельная фаза замера
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Бюджет, мс: импорт своих модулей + on_startup + обработка первого обновления
+OWN_BUDGET_MS = 250
+PHASES = ("aiogram", "bot", "startup", "first_update")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--submissions', type=int, default=10000, help="отправок в хранилище перед стартом")
+    parser.add_argument('--store', default='file', choices=('file', 'sqlite'), help="STORAGE_BACKEND")
+    parser.add_argument('--budget', type=float, default=OWN_BUDGET_MS, help="бюджет на свои фазы, мс")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# Хранилище с историей: на холодном старте его чтение - часть задержки
+def prepare_store(directory, backend, submissions):
+    records = (
+        {"user_id": str(100000 + i), "username": f"user{i}", "timestamp": "2026-01-01 10:00:00",
+         "quiz_id": "default", "answers": {"1": "ответ", "2": "ответ", "3": "Существует"}, "admin_response": None}
+        for i in range(submissions)
+    )
+    if backend == "file":
+        with open(os.path.join(directory, 'all_answers.jsonl'), 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return
+    import sqlite3
+    conn = sqlite3.connect(os.path.join(directory, 'submissions.db'))
+    conn.execute(
+        "CREATE TABLE submissions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, username TEXT, "
+        "timestamp TEXT NOT NULL, answers TEXT NOT NULL, admin_response TEXT, "
+        "quiz_id TEXT NOT NULL DEFAULT 'default', score TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO submissions (user_id, username, timestamp, answers) VALUES (?, ?, ?, ?)",
+        ((r['user_id'], r['username'], r['timestamp'], json.dumps(r['answers'], ensure_ascii=False)) for r in records)
+    )
+    conn.commit()
+    conn.close()
+
+
+# Один холодный старт в отдельном процессе; печатает длительности фаз в мс
+def child(directory):
+    import time
+    started = time.perf_counter()
+    marks = {}
+
+    import aiogram  # noqa: F401
+    marks["aiogram"] = time.perf_counter()
+
+    import asyncio
+    import logging
+    from fake_telegram import FakeSession, UpdateFactory
+    os.environ.update(METRICS_PORT='0', LOG_LEVEL='WARNING')
+    import bot
+    marks["bot"] = time.perf_counter()
+
+    class FirstReply(FakeSession):
+        async def make_request(self, bot_, method, timeout=None):
+            if "first_update" not in marks and getattr(method, "text", None):
+                marks["first_update"] = time.perf_counter()
+            return await super().make_request(bot_, method, timeout)
+
+    async def run():
+        logging.disable(logging.CRITICAL)
+        bot.bot.session = FirstReply()
+        os.chdir(directory)
+        await bot.dp.emit_startup(bot=bot.bot)
+        marks["startup"] = time.perf_counter()
+        await bot.dp.feed_update(bot.bot, UpdateFactory().message(1, "/start"))
+        await bot.dp.emit_shutdown(bot=bot.bot)
+
+    asyncio.run(run())
+    previous = started
+    result = {}
+    for phase in PHASES:
+        result[phase] = (marks[phase] - previous) * 1000
+        previous = marks[phase]
+    print(json.dumps(result))
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    results = []
+    for _ in range(args.runs):
+        directory = tempfile.mkdtemp()
+        prepare_store(directory, args.store, args.submissions)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', directory],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+            env=dict(os.environ, STORAGE_BACKEND=args.store)
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"Прогонов: {args.runs}, отправок в хранилище: {args.submissions} ({args.store})")
+    print(f"{'фаза':>14} {'медиана, мс':>12} {'мин, мс':>9}")
+    for phase in PHASES:
+        values = [result[phase] for result in results]
+        print(f"{phase:>14} {statistics.median(values):>12.1f} {min(values):>9.1f}")
+
+    own = statistics.median(sum(result[phase] for phase in PHASES[1:]) for result in results)
+    total = statistics.median(sum(result.values()) for result in results)
+    status = "в бюджете" if own <= args.budget else "ПРЕВЫШЕН"
+    print(f"\nДо первого ответа: {total:.1f} мс, из них своё: {own:.1f} мс (бюджет {args.budget:.0f} мс) - {status}")
+    if own > args.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import datetime
+import itertools
+import os
+import sys
+
+# Бенчмарки запускаются из корня репозитория: python benchmarks/<скрипт>.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, GetMe, SendMessage, SendPhoto
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+
+# Сессия бота без сети: на каждый запрос сразу возвращает правдоподобный ответ
+class FakeSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if isinstance(method, (SendMessage, SendPhoto, EditMessageText)):
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=method.chat_id, type='private'),
+                text=getattr(method, 'text', None) or ''
+            )
+        if isinstance(method, GetMe):
+            return User(id=bot.id, is_bot=True, first_name="bot", username="benchmark_bot")
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+# Генератор синтетических обновлений от пользователей
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}")
+
+    def message(self, user_id, text):
+        update_id = next(self._ids)
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=user_id, type='private'),
+            from_user=self._user(user_id),
+            text=text
+        ))
+
+    def callback(self, user_id, data):
+        update_id = next(self._ids)
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id),
+            from_user=self._user(user_id),
+            chat_instance=str(user_id),
+            data=data,
+            message=Message(
+                message_id=update_id,
+                date=datetime.datetime.now(),
+                chat=Chat(id=user_id, type='private'),
+                from_user=User(id=1, is_bot=True, first_name="bot"),
+                text="..."
+            )
+        ))
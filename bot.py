@@ -1,22 +1,46 @@
 import asyncio
 import logging
-import json
 import os
-import csv
 from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton, ReplyKeyboardMarkup, InputFile
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton, ReplyKeyboardMarkup, FSInputFile
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramAPIError
 from dotenv import load_dotenv
 
+import admin_browser
+import metrics
+from digest import AdminDigest, format_digest
+from lifecycle import UpdateLifecycle
+from antiflood import AntiFloodMiddleware
+from media_cache import MediaCache
+from pending_queue import PendingQueue
+from config_watcher import ConfigWatcher
+from fsm_storage import create_fsm_storage, create_events_isolation, count_sessions_by_state, session_usage
+from outbound import OutboundScheduler, bulk
+from quiz import DEFAULT_QUIZ_ID, Test
+from quiz_catalog import QuizCatalog
+from stats import StatsAggregator
+from scoring import ScoringEngine
+from session_reaper import SessionReaper
+from warmup import WarmUp
+from storage import create_store, entry_quiz_id
+from write_behind import SubmissionWriter
+from log_setup import setup_logging
+
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: JSON через очередь, запись в файл/консоль в фоновом потоке
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Доля "горячих" событий (на каждое обновление), которые попадают в лог
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+# Скрывать тексты ответов пользователей
+LOG_REDACT = os.getenv('LOG_REDACT', '1') == '1'
+setup_logging(LOG_LEVEL, json_format=LOG_FORMAT == 'json', sample_rate=LOG_SAMPLE_RATE, redact=LOG_REDACT)
 logger = logging.getLogger(__name__)
 
 # Токен бота
@@ -30,97 +54,291 @@ ADMIN_ID = 101189677
 # Версия бота
 CURRENT_VERSION = "1.1.0"
 
+# Режим работы: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.getenv('PORT', '8080'))
+
+# Хранилище отправок: file (all_answers.jsonl + test_results.csv) или sqlite
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'file')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'submissions.db')
+
+# Очередь фоновой записи отправок
+WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', '1000'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '50'))
+# Куда дописываются отправки, которые не удалось сохранить и после повторов
+FAILED_SUBMISSIONS_PATH = os.getenv('FAILED_SUBMISSIONS_PATH', 'failed_submissions.jsonl')
+
+# Сколько пользователей показывать на одной странице браузера ответов
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '3'))
+
+# Лимиты исходящих сообщений (сообщений в секунду)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+
+# FSM-хранилище сессий теста: memory, sqlite или redis
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+FSM_SQLITE_PATH = os.getenv('FSM_SQLITE_PATH', 'fsm.db')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Время жизни неактивной сессии (секунды), 0 - без ограничения
+FSM_TTL = int(os.getenv('FSM_TTL', str(7 * 24 * 3600))) or None
+# Проверка истёкших сессий раз в SESSION_REAP_INTERVAL секунд пачками по SESSION_REAP_BATCH;
+# за SESSION_REMIND_BEFORE секунд до удаления незавершённого теста - напоминание (0 - без напоминаний)
+SESSION_REAP_INTERVAL = int(os.getenv('SESSION_REAP_INTERVAL', '60'))
+SESSION_REAP_BATCH = int(os.getenv('SESSION_REAP_BATCH', '500'))
+SESSION_REMIND_BEFORE = int(os.getenv('SESSION_REMIND_BEFORE', str(24 * 3600)))
+
+# Кэш file_id картинок и прогрев кэша при старте (картинки отправляются админу и удаляются)
+MEDIA_CACHE_PATH = os.getenv('MEDIA_CACHE_PATH', 'media_cache.json')
+MEDIA_PREWARM = os.getenv('MEDIA_PREWARM', '0') == '1'
+
+# Как часто проверять изменения questions.json и versions/ (секунды)
+CONFIG_RELOAD_INTERVAL = int(os.getenv('CONFIG_RELOAD_INTERVAL', '5'))
+
+# Как часто запускать обслуживание хранилища (секунды)
+STORAGE_MAINTENANCE_INTERVAL = int(os.getenv('STORAGE_MAINTENANCE_INTERVAL', '600'))
+
+# Остановка: сколько ждать текущие обработчики (секунды) и где хранить границу обработанных обновлений
+SHUTDOWN_DRAIN_TIMEOUT = int(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '20'))
+POLLING_OFFSET_PATH = os.getenv('POLLING_OFFSET_PATH', 'polling_offset.json')
+
+# Уведомления админа о новых ответах: digest - сводкой раз в DIGEST_WINDOW секунд
+# или по достижении DIGEST_MAX_ITEMS, immediate - сообщением на каждое завершение
+NOTIFY_MODE = os.getenv('NOTIFY_MODE', 'digest')
+DIGEST_WINDOW = int(os.getenv('DIGEST_WINDOW', '60'))
+DIGEST_MAX_ITEMS = int(os.getenv('DIGEST_MAX_ITEMS', '50'))
+
+# Каталог дополнительных тестов (quizzes/<quiz_id>.json) и лимиты кэша загруженных тестов
+QUIZZES_DIR = os.getenv('QUIZZES_DIR', 'quizzes')
+QUIZ_CACHE_SIZE = int(os.getenv('QUIZ_CACHE_SIZE', '16'))
+QUIZ_CACHE_QUESTIONS = int(os.getenv('QUIZ_CACHE_QUESTIONS', '5000'))
+
+# Ключи автоматической оценки (scoring/<quiz_id>.json); тесты без ключа не оцениваются
+SCORING_DIR = os.getenv('SCORING_DIR', 'scoring')
+
+# Анти-флуд: обновлений в секунду на пользователя и запас на всплеск (FLOOD_RATE=0 - без лимита)
+FLOOD_RATE = float(os.getenv('FLOOD_RATE', '3'))
+FLOOD_BURST = int(os.getenv('FLOOD_BURST', '10'))
+# Повторное нажатие той же кнопки в течение стольких секунд считается дублем
+CALLBACK_DEDUP_TTL = float(os.getenv('CALLBACK_DEDUP_TTL', '2'))
+
+# Локальный /metrics в формате Prometheus (METRICS_PORT=0 - выключен)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+fsm_storage = create_fsm_storage(FSM_STORAGE, sqlite_path=FSM_SQLITE_PATH, redis_url=REDIS_URL, ttl=FSM_TTL)
+dp = Dispatcher(storage=fsm_storage, events_isolation=create_events_isolation(fsm_storage))
+
+# Все исходящие запросы проходят через планировщик с лимитами Telegram
+outbound_scheduler = OutboundScheduler(global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE)
+bot.session.middleware(outbound_scheduler)
+# Регистрируется после планировщика, поэтому меряет сам запрос без ожидания в очереди
+bot.session.middleware(metrics.ApiMetricsMiddleware())
+
+# Обработчики в работе и граница обработанных update_id - для плавной остановки и перезапуска
+# В режиме webhook update_id приходят параллельно в несколько процессов - границу не ведём
+lifecycle = UpdateLifecycle(
+    POLLING_OFFSET_PATH if BOT_MODE != "webhook" else None, drain_timeout=SHUTDOWN_DRAIN_TIMEOUT
+)
+dp.update.outer_middleware(lifecycle)
+# Диспетчер закрывает хранилище FSM первым обработчиком остановки - раньше, чем мы дождёмся
+# текущих обработчиков. Закрываем его сами в конце on_shutdown
+dp.shutdown.handlers[:] = [handler for handler in dp.shutdown.handlers if handler.callback != dp.fsm.close]
 
+# Метрики обновлений и обработчиков
+dp.update.outer_middleware(metrics.UpdateMetricsMiddleware())
 
-# Загрузка вопросов из JSON файла
-def load_questions():
-    try:
-        with open('questions.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('questions', [])
-    except FileNotFoundError:
-        logger.error("Файл questions.json не найден!")
-        return []
-    except json.JSONDecodeError:
-        logger.error("Ошибка чтения questions.json!")
-        return []
-
-
-# Получение версии из файла
+# Защита от флуда и двойных нажатий; обновления одного пользователя обрабатываются по очереди
+dp.update.outer_middleware(AntiFloodMiddleware(
+    rate=FLOOD_RATE,
+    burst=FLOOD_BURST,
+    double_tap_ttl=CALLBACK_DEDUP_TTL,
+    exempt_user_ids=(ADMIN_ID,),
+    navigation_prefixes=("admin_page_", "admin_stats_")
+))
+
+# Статистика и очередь ожидающих строятся в фоне после старта; обновления админа их дожидаются
+warm_up = WarmUp(user_ids=(ADMIN_ID,))
+dp.update.outer_middleware(warm_up)
+
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+
+
+# Вопросы и версии: загружаются при старте и перечитываются при изменении файлов
+config = ConfigWatcher('questions.json', 'versions', interval=CONFIG_RELOAD_INTERVAL).load()
+
+
+# Дополнительные тесты читаются при первом обращении
+quiz_catalog = QuizCatalog(
+    QUIZZES_DIR, max_loaded=QUIZ_CACHE_SIZE, max_questions=QUIZ_CACHE_QUESTIONS, check_interval=CONFIG_RELOAD_INTERVAL
+)
+
+
+# Актуальный тест по id: (Quiz, версия) или (None, None)
+async def get_quiz(quiz_id):
+    if quiz_id in (None, DEFAULT_QUIZ_ID):
+        return config.quiz, config.quiz_version
+    return await quiz_catalog.get(quiz_id)
+
+
+# Тест сессии в той версии, с которой она начала; None, если тест пропал из каталога
+async def get_session_quiz(data):
+    quiz_id = data.get('quiz_id', DEFAULT_QUIZ_ID)
+    if quiz_id == DEFAULT_QUIZ_ID:
+        return config.get_quiz(data.get('quiz_version'))
+    return await quiz_catalog.get_quiz(quiz_id, data.get('quiz_version'))
+
+
+# Информация о текущей версии (из памяти, без чтения versions/)
 def get_current_version_info():
-    versions_dir = "versions"
-    if not os.path.exists(versions_dir):
-        return None
-    
-    version_files = sorted([f for f in os.listdir(versions_dir) if f.endswith('.json')])
-    if not version_files:
-        return None
-    
-    latest_version_file = os.path.join(versions_dir, version_files[-1])
+    return config.version_info
+
+
+# Хранилище отправок теста
+store = create_store(STORAGE_BACKEND, sqlite_path=SQLITE_PATH, question_ids=config.quiz.question_ids)
+
+
+# Уведомление админа о новых ответах: по сообщению на каждое завершение
+async def notify_admin(items):
+    for item in items:
+        try:
+            with bulk():
+                await bot.send_message(
+                    ADMIN_ID,
+                    f"🔔 **Новый ответ на тест!**\n\n"
+                    f"Пользователь: @{item['mention']}\n"
+                    f"ID: {item['user_id']}",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление админу: {e}")
+
+
+# Ссылка, открывающая у админа список ожидающих ответа (/start pending)
+async def pending_browser_link():
     try:
-        with open(latest_version_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
+        me = await bot.me()
+        return f"https://t.me/{me.username}?start=pending"
+    except Exception as e:
+        logger.warning(f"Не удалось получить имя бота для ссылки: {e}")
         return None
 
 
-# Сохранение ответов в CSV
-def save_to_csv(user_id, username, answers):
-    csv_file = "test_results.csv"
-    file_exists = os.path.isfile(csv_file)
-    
-    with open(csv_file, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(["user_id", "username", "timestamp", "Q1", "Q2", "Q3"])
-        row = [user_id, username, datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
-        for q_id in range(1, 4):
-            row.append(answers.get(str(q_id), ""))
-        writer.writerow(row)
+# Отправка сводки по накопленным завершениям
+async def send_digest(items, started_at):
+    text = format_digest(items, started_at, link=await pending_browser_link())
+    with bulk():
+        await bot.send_message(ADMIN_ID, text)
 
 
-# Сохранение всех ответов в JSON для админ-панели
-def save_all_answers(user_id, username, answers):
-    json_file = "all_answers.json"
-    data = {}
-    
-    if os.path.isfile(json_file):
+admin_digest = AdminDigest(send_digest, window=DIGEST_WINDOW, max_items=DIGEST_MAX_ITEMS)
+
+
+# Сразу после записи пачки: статистика и очередь ожидающих
+def on_submissions_saved(items):
+    for item in items:
+        stats_aggregator.record_submission(item['user_id'], item['entry'])
+        pending_queue.record_submission(item['user_id'], item['entry'])
+
+
+# Уведомление админа о записанной пачке (отдельной задачей писателя, запись его не ждёт)
+async def on_submissions_notify(items):
+    if NOTIFY_MODE == "immediate":
+        await notify_admin(items)
+    else:
+        await admin_digest.add(items)
+
+
+scoring_engine = ScoringEngine(SCORING_DIR)
+
+
+# Оценка пачки перед записью: TF-IDF считается в рабочем потоке, а не в цикле событий
+async def score_submissions(items):
+    def score_batch():
+        for item in items:
+            entry = item['entry']
+            scoring_engine.score_entry(entry_quiz_id(entry), entry)
+    await asyncio.to_thread(score_batch)
+
+
+# Фоновая запись завершённых тестов
+writer = SubmissionWriter(
+    store, notify=on_submissions_notify, saved=on_submissions_saved, prepare=score_submissions,
+    maxsize=WRITE_QUEUE_SIZE, batch_size=WRITE_BATCH_SIZE, fallback_path=FAILED_SUBMISSIONS_PATH
+)
+
+
+# Периодическое обслуживание хранилища отправок (компакция журнала, чекпоинт WAL)
+async def maintain_store_periodically():
+    while True:
+        await asyncio.sleep(STORAGE_MAINTENANCE_INTERVAL)
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except json.JSONDecodeError:
-            data = {}
-    
-    if str(user_id) not in data:
-        data[str(user_id)] = []
-    
-    data[str(user_id)].append({
-        "username": username,
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "answers": answers,
-        "admin_response": None
-    })
-    
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+            await store.maintenance()
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания хранилища: {e}")
+
+
+# Напоминание о брошенном тесте до удаления сессии (низкий приоритет, как и рассылки)
+async def remind_abandoned_test(chat_id, data):
+    if SESSION_REMIND_BEFORE >= 3600:
+        left = f"{SESSION_REMIND_BEFORE // 3600} ч."
+    else:
+        left = f"{max(SESSION_REMIND_BEFORE // 60, 1)} мин."
+    text = (
+        f"⏰ Вы начали тест, но не закончили (отвечено вопросов: {len(data.get('test_answers', {}))}).\n"
+        f"Если не продолжить, ответы будут удалены примерно через {left}"
+    )
+    with bulk():
+        await bot.send_message(chat_id, text)
+
+
+# Истёкшие сессии теста (Redis удаляет их сам по TTL)
+session_reaper = SessionReaper(
+    fsm_storage, FSM_TTL, remind=remind_abandoned_test, remind_before=SESSION_REMIND_BEFORE,
+    interval=SESSION_REAP_INTERVAL, batch_size=SESSION_REAP_BATCH
+) if FSM_TTL and hasattr(fsm_storage, 'idle_sessions') else None
+
+
+# Кэш file_id картинок вопросов
+media_cache = MediaCache(MEDIA_CACHE_PATH, check_interval=CONFIG_RELOAD_INTERVAL).load()
+
+# Накопительная статистика для админ-панели
+stats_aggregator = StatsAggregator(config.quiz.choice_questions)
+
+# Пользователи, ждущие ответа админа, от самых давних
+pending_queue = PendingQueue()
+
+
+# Начальное заполнение статистики и очереди ожидающих за один проход по хранилищу.
+# Идёт при прогреве до запуска записи, поэтому новые отправки не учитываются дважды
+def load_indexes():
+    for user_id, entry in store.iter_submissions():
+        stats_aggregator.record_submission(user_id, entry)
+        pending_queue.record_submission(user_id, entry)
 
 
-# Определение состояний для Теста (с подтверждением)
-class Test(StatesGroup):
-    Q1 = State()
-    Q2 = State()
-    Q3 = State()
-    # Состояния для подтверждения
-    ConfirmQ1 = State()
-    ConfirmQ2 = State()
-    ConfirmQ3 = State()
+# При смене вопросов обновляем зависящие от них структуры
+def on_quiz_reloaded(quiz):
+    stats_aggregator.set_choice_questions(quiz.choice_questions)
+    store.set_question_ids(quiz.question_ids)
 
 
-# Загружаем вопросы
-QUESTIONS = load_questions()
+config.listeners.append(on_quiz_reloaded)
+
+
+# Тест каталога загружен или сменил версию: колонки его CSV - по определению теста
+def on_catalog_quiz_loaded(quiz_id, quiz):
+    store.set_question_ids(quiz.question_ids, quiz_id)
+
+
+quiz_catalog.listeners.append(on_catalog_quiz_loaded)
 
 
 # Главное меню (Reply Keyboard)
@@ -146,6 +364,9 @@ admin_menu = InlineKeyboardMarkup(
             InlineKeyboardButton(text="📋 Все ответы", callback_data="admin_all"),
             InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")
         ],
+        [
+            admin_browser.NEXT_PENDING_BUTTON
+        ],
         [
             InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_refresh")
         ]
@@ -181,37 +402,20 @@ confirm_keyboard = InlineKeyboardMarkup(
 )
 
 
-# Генерация клавиатуры для вопроса
-def get_question_keyboard(question_num):
-    if not QUESTIONS:
-        return None
-    
-    q = QUESTIONS[question_num - 1]
-    if q['type'] == 'choice':
-        keyboard = []
-        for i, option in enumerate(q.get('options', [])):
-            keyboard.append([InlineKeyboardButton(
-                text=option, 
-                callback_data=f"answer_{question_num}_{i}"
-            )])
-        keyboard.append([InlineKeyboardButton(
-            text="❌ Отмена", 
-            callback_data="cancel_test"
-        )])
-        return InlineKeyboardMarkup(inline_keyboard=keyboard)
-    else:
-        # Для текстовых вопросов - кнопка отмены
-        return InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(
-                text="❌ Отмена", 
-                callback_data="cancel_test"
-            )]]
-        )
-
-
 # Обработчик команды /start
 @dp.message(Command(commands=["start"]))
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, command: CommandObject, state: FSMContext):
+    # Ссылка из сводки: /start pending открывает админу браузер ответов с фильтром
+    if command.args in admin_browser.FILTERS and message.from_user.id == ADMIN_ID:
+        text, keyboard = await admin_browser.render_page(store, command.args, 0, page_size=ADMIN_PAGE_SIZE)
+        await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    # Ссылка на конкретный тест: t.me/<бот>?start=<quiz_id>
+    if command.args and (command.args == DEFAULT_QUIZ_ID or quiz_catalog.exists(command.args)):
+        await start_quiz(message, state, command.args)
+        return
+    
     await message.answer(
         "Привет! Я Telegram бот с тестированием.\n\n"
         "Нажмите «🧪 Начать тестирование», чтобы пройти опрос.",
@@ -251,12 +455,84 @@ async def cmd_admin(message: types.Message):
     
     await message.answer(
         "🔧 **Админ-панель**\n\n"
-        "Выберите действие:",
+        "Выберите действие:\n"
+        "🔍 Поиск ответа: /find <user_id или @username>\n"
+        "📤 Выгрузка результатов: /export",
         reply_markup=admin_menu,
         parse_mode=ParseMode.MARKDOWN
     )
 
 
+# Обработчик команды /find <user_id или @username> - поиск ответа пользователя
+@dp.message(Command(commands=["find"]))
+async def cmd_find(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("⛔ У вас нет доступа к админ-панели.")
+        return
+    
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        await message.answer("🔍 Использование: /find <user_id или @username>")
+        return
+    
+    found = await store.find_user(query)
+    if not found:
+        await message.answer("🔍 Ничего не найдено.")
+        return
+    
+    user_id, entry = found
+    await message.answer(
+        admin_browser.format_entry(user_id, entry),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[admin_browser.respond_button(user_id, entry)]]),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+
+# Обработчик команды /export - выгрузка результатов документом
+@dp.message(Command(commands=["export"]))
+async def cmd_export(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("⛔ У вас нет доступа к админ-панели.")
+        return
+    
+    # Выгрузка нужна редко - модуль загружается при первой команде
+    import export
+    
+    try:
+        filters = export.parse_export_args(message.text)
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n\n{export.USAGE}")
+        return
+    
+    # Колонки по умолчанию - вопросы выбранного теста, включая вопросы его прежних версий,
+    # на которых ещё могли завершаться начатые сессии
+    if filters["question_ids"] is None:
+        quiz, _ = await get_quiz(filters["quiz_id"])
+        if quiz is None:
+            await message.answer(f"❌ Тест {filters['quiz_id']} не найден.")
+            return
+        if filters["quiz_id"] == DEFAULT_QUIZ_ID:
+            filters["question_ids"] = config.known_question_ids()
+        else:
+            filters["question_ids"] = quiz_catalog.known_question_ids(filters["quiz_id"])
+    
+    await message.answer("⏳ Готовлю выгрузку...")
+    try:
+        path, filename, count = await export.export_to_file(store, filters)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки: {e}")
+        await message.answer("❌ Не удалось подготовить выгрузку.")
+        return
+    
+    try:
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"📤 Строк: {count}")
+    finally:
+        os.remove(path)
+
+
 # Обработчик кнопки "📋 Меню"
 @dp.message(F.text == "📋 Меню")
 async def show_menu(message: types.Message):
@@ -283,18 +559,46 @@ async def about_bot(message: types.Message):
     )
 
 
+# Выбор теста, если кроме основного есть тесты в каталоге
+def quiz_menu(quiz_ids):
+    keyboard = [[InlineKeyboardButton(text="🧪 Основной тест", callback_data=f"quiz_{DEFAULT_QUIZ_ID}")]]
+    for quiz_id in quiz_ids:
+        keyboard.append([InlineKeyboardButton(text=f"📝 {quiz_catalog.title(quiz_id)}", callback_data=f"quiz_{quiz_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
 # Обработчик кнопки "🧪 Начать тестирование"
 @dp.message(F.text == "🧪 Начать тестирование")
 async def start_test(message: types.Message, state: FSMContext):
-    if not QUESTIONS:
+    quiz_ids = quiz_catalog.list_ids()
+    if quiz_ids:
+        await message.answer("🧪 Выберите тест:", reply_markup=quiz_menu(quiz_ids))
+        return
+    await start_quiz(message, state, DEFAULT_QUIZ_ID)
+
+
+# Выбор теста в меню
+@dp.callback_query(F.data.startswith("quiz_"))
+async def choose_quiz_callback(callback: types.CallbackQuery, state: FSMContext):
+    await start_quiz(callback.message, state, callback.data[len("quiz_"):], user=callback.from_user)
+    await callback.answer()
+
+
+# Начало теста (user - проходящий; для callback это не автор message)
+async def start_quiz(message: types.Message, state: FSMContext, quiz_id, user=None):
+    # Сессия закрепляется за текущим снимком вопросов до конца теста
+    quiz, quiz_version = await get_quiz(quiz_id)
+    if not quiz:
         await message.answer(
             "❌ Вопросы не загружены. Обратитесь к администратору."
         )
         return
     
+    title = f"«{admin_browser.escape_md(quiz.title)}»\n" if quiz.title else ""
     await message.answer(
         "🧪 **Тестирование началось!**\n\n"
-        f"Всего вопросов: {len(QUESTIONS)}\n"
+        f"{title}"
+        f"Всего вопросов: {quiz.total}\n"
         "После каждого ответа нужно будет подтвердить его.",
         reply_markup=ReplyKeyboardMarkup(
             keyboard=[[KeyboardButton(text="❌ Отмена теста")]],
@@ -303,38 +607,27 @@ async def start_test(message: types.Message, state: FSMContext):
         parse_mode=ParseMode.MARKDOWN
     )
     
-    await state.update_data(test_answers={})
-    await state.set_state(Test.Q1)
-    await ask_question(message, state, 1)
+    await state.set_data({'test_answers': {}, 'quiz_id': quiz_id, 'quiz_version': quiz_version})
+    await ask_question(message, state, quiz, 1, user=user)
 
 
-# Функция для отправки вопроса
-async def ask_question(message: types.Message, state: FSMContext, question_num):
-    if question_num > len(QUESTIONS):
+# Функция для отправки вопроса (user - отвечающий; для callback это не автор message)
+async def ask_question(message: types.Message, state: FSMContext, quiz, question_num, user=None):
+    user = user or message.from_user
+    
+    if quiz.is_finished(question_num):
         data = await state.get_data()
         answers = data.get('test_answers', {})
         
-        save_to_csv(
-            user_id=message.from_user.id,
-            username=message.from_user.username or f"user_{message.from_user.id}",
-            answers=answers
+        # Запись и уведомление админа уходят в фоновую очередь
+        await writer.submit(
+            user_id=user.id,
+            username=user.username or f"user_{user.id}",
+            answers=answers,
+            mention=user.username or user.id,
+            quiz_id=data.get('quiz_id', DEFAULT_QUIZ_ID),
+            quiz_version=data.get('quiz_version')
         )
-        save_all_answers(
-            user_id=message.from_user.id,
-            username=message.from_user.username or f"user_{message.from_user.id}",
-            answers=answers
-        )
-        
-        try:
-            await bot.send_message(
-                ADMIN_ID,
-                f"🔔 **Новый ответ на тест!**\n\n"
-                f"Пользователь: @{message.from_user.username or message.from_user.id}\n"
-                f"ID: {message.from_user.id}",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            logger.error(f"Не удалось отправить уведомление админу: {e}")
         
         await message.answer(
             "✅ **Тест завершен!**\n\n"
@@ -345,25 +638,60 @@ async def ask_question(message: types.Message, state: FSMContext, question_num):
         await state.clear()
         return
     
-    q = QUESTIONS[question_num - 1]
-    keyboard = get_question_keyboard(question_num)
+    await state.set_state(Test.Answering)
+    await state.update_data(question_num=question_num)
     
-    text = f"**Вопрос {question_num} из {len(QUESTIONS)}**\n\n{q['text']}"
+    render = quiz.render(question_num)
+    
+    if render.image:
+        try:
+            await send_question_photo(message, render)
+            return
+        except Exception as e:
+            logger.error(f"Ошибка отправки картинки: {e}")
     
-    image_path = q.get('image', '')
-    if image_path and os.path.isfile(image_path):
+    await message.answer(render.text, reply_markup=render.keyboard, parse_mode=ParseMode.MARKDOWN)
+
+
+# Отправка картинки вопроса: повторно используем file_id, загружаем файл только первый раз
+async def send_question_photo(message: types.Message, render):
+    file_id = media_cache.get(render.image)
+    if file_id:
         try:
             await message.answer_photo(
-                photo=InputFile(image_path),
-                caption=text,
-                reply_markup=keyboard,
+                photo=file_id,
+                caption=render.text,
+                reply_markup=render.keyboard,
                 parse_mode=ParseMode.MARKDOWN
             )
             return
         except Exception as e:
-            logger.error(f"Ошибка отправки картинки: {e}")
+            logger.warning(f"Сохранённый file_id для {render.image} не подошёл: {e}")
+            await media_cache.forget(render.image)
     
-    await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+    sent = await message.answer_photo(
+        photo=FSInputFile(render.image),
+        caption=render.text,
+        reply_markup=render.keyboard,
+        parse_mode=ParseMode.MARKDOWN
+    )
+    await media_cache.put(render.image, sent.photo[-1].file_id)
+
+
+# Прогрев кэша: загружаем ещё не закэшированные картинки в чат админа и сразу удаляем
+async def prewarm_media_cache():
+    quiz = config.quiz
+    for num in range(1, quiz.total + 1):
+        image = quiz.render(num).image
+        if not image or media_cache.get(image):
+            continue
+        try:
+            with bulk():
+                sent = await bot.send_photo(ADMIN_ID, FSInputFile(image), disable_notification=True)
+                await media_cache.put(image, sent.photo[-1].file_id)
+                await sent.delete()
+        except Exception as e:
+            logger.warning(f"Не удалось прогреть кэш для {image}: {e}")
 
 
 # Функция для показа подтверждения
@@ -377,29 +705,17 @@ async def show_confirmation(message: types.Message, state: FSMContext, question_
     )
     
     # Сохраняем временный ответ в состояние
-    confirm_state_map = {
-        1: Test.ConfirmQ1,
-        2: Test.ConfirmQ2,
-        3: Test.ConfirmQ3
-    }
     await state.update_data(
         current_answer=user_answer, 
         current_question=question_num,
         chat_id=message.chat.id
     )
-    await state.set_state(confirm_state_map[question_num])
+    await state.set_state(Test.Confirming)
 
 
 # Переход к следующему вопросу
-async def next_question(message, state, current_question_num):
-    next_num = current_question_num + 1
-    
-    if next_num == 2:
-        await state.set_state(Test.Q2)
-    elif next_num == 3:
-        await state.set_state(Test.Q3)
-    
-    await ask_question(message, state, next_num)
+async def next_question(message, state, quiz, current_question_num, user=None):
+    await ask_question(message, state, quiz, quiz.next(current_question_num), user=user)
 
 
 # ========== CALLBACK ОБРАБОТЧИКИ ==========
@@ -415,12 +731,52 @@ async def admin_callback(callback: types.CallbackQuery):
         await show_all_answers(callback)
     elif callback.data == "admin_stats":
         await show_stats(callback)
+    elif callback.data.startswith("admin_stats_"):
+        await show_stats(callback, view=callback.data[len("admin_stats_"):])
+    elif callback.data.startswith("admin_page_"):
+        status_key, page, anchor = admin_browser.parse_page_callback(callback.data)
+        await show_all_answers(callback, status_key, page, anchor)
+    elif callback.data == "admin_next_pending":
+        await show_next_pending(callback)
     elif callback.data == "admin_refresh":
         await cmd_admin(callback.message)
     
     await callback.answer()
 
 
+# Кнопка "💬 Ответить": админ переходит в режим ввода ответа
+@dp.callback_query(F.data.startswith("respond_"))
+async def respond_callback(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ У вас нет доступа!")
+        return
+    
+    user_id = callback.data[len("respond_"):]
+    found = await store.find_user(user_id)
+    if not found:
+        await callback.answer("Пользователь не найден")
+        return
+    
+    _, entry = found
+    await state.set_state(admin_browser.AdminReply.Writing)
+    await state.update_data(respond_to=user_id)
+    await callback.message.answer(
+        f"✍️ Напишите ответ для @{admin_browser.escape_md(entry['username'])} одним сообщением.",
+        reply_markup=admin_browser.reply_cancel_keyboard,
+        parse_mode=ParseMode.MARKDOWN
+    )
+    await callback.answer()
+
+
+# Отмена ввода ответа админом
+@dp.callback_query(F.data == "reply_cancel")
+async def reply_cancel_callback(callback: types.CallbackQuery, state: FSMContext):
+    if await state.get_state() == admin_browser.AdminReply.Writing.state:
+        await state.clear()
+        await callback.message.edit_text("Ответ отменён.")
+    await callback.answer()
+
+
 # Обработчик отмены теста
 @dp.callback_query(F.data == "cancel_test")
 async def cancel_test_callback(callback: types.CallbackQuery, state: FSMContext):
@@ -440,20 +796,25 @@ async def process_answer(callback: types.CallbackQuery, state: FSMContext):
     question_num = int(parts[1])
     answer_num = int(parts[2])
     
-    q = QUESTIONS[question_num - 1]
-    answer_text = q['options'][answer_num]
+    # Кнопка от старого вопроса или вне теста - игнорируем
+    data = await state.get_data()
+    current_state = await state.get_state()
+    quiz = await get_session_quiz(data)
+    answer_text = quiz.option(question_num, answer_num) if quiz else None
+    if current_state != Test.Answering.state or data.get('question_num') != question_num or answer_text is None:
+        await callback.answer()
+        return
     
     # Сразу сохраняем вариантный ответ (он уже выбран)
-    data = await state.get_data()
     answers = data.get('test_answers', {})
-    answers[str(question_num)] = answer_text
+    answers[quiz.answer_key(question_num)] = answer_text
     await state.update_data(test_answers=answers)
     
     await callback.message.edit_text(
         f"✅ Ответ принят: **{answer_text}**"
     )
     
-    await next_question(callback.message, state, question_num)
+    await next_question(callback.message, state, quiz, question_num, user=callback.from_user)
     await callback.answer()
 
 
@@ -462,10 +823,10 @@ async def process_answer(callback: types.CallbackQuery, state: FSMContext):
 async def confirm_answer(callback: types.CallbackQuery, state: FSMContext):
     current_state = await state.get_state()
     
-    logger.info(f"confirm_answer вызван, state: {current_state}, data: {callback.data}")
+    logger.debug("confirm_answer", extra={"hot": True, "state": current_state, "data": callback.data})
     
-    if not current_state or not current_state.startswith("Test:Confirm"):
-        logger.info(f"Состояние не подходит для подтверждения: {current_state}")
+    if current_state != Test.Confirming.state:
+        logger.debug("Состояние не подходит для подтверждения", extra={"hot": True, "state": current_state})
         await callback.answer()
         return
     
@@ -473,13 +834,20 @@ async def confirm_answer(callback: types.CallbackQuery, state: FSMContext):
     user_answer = data.get('current_answer', '')
     question_num = data.get('current_question', 1)
     chat_id = data.get('chat_id', callback.message.chat.id)
+    quiz = await get_session_quiz(data)
+    # Снимок версии сессии мог не сохраниться (перезапуск), а в текущем тесте вопросов меньше
+    if quiz is None or not quiz.has(question_num):
+        await state.clear()
+        await callback.message.answer("❌ Этот тест изменился или больше недоступен. Начните заново.", reply_markup=main_menu)
+        await callback.answer()
+        return
     
     if callback.data == "confirm_yes":
-        logger.info(f"Нажата кнопка Да, сохраняем ответ: {user_answer}")
+        logger.debug("Ответ подтверждён", extra={"hot": True, "question": question_num, "answer": user_answer})
         
         # Подтверждено - сохраняем ответ
         answers = data.get('test_answers', {})
-        answers[str(question_num)] = user_answer
+        answers[quiz.answer_key(question_num)] = user_answer
         await state.update_data(test_answers=answers)
         
         # Удаляем сообщение с подтверждением
@@ -496,15 +864,9 @@ async def confirm_answer(callback: types.CallbackQuery, state: FSMContext):
         )
         
         # Переходим к следующему вопросу
-        next_num = question_num + 1
-        if next_num == 2:
-            await state.set_state(Test.Q2)
-        elif next_num == 3:
-            await state.set_state(Test.Q3)
-        
-        await ask_question(callback.message, state, next_num)
+        await next_question(callback.message, state, quiz, question_num, user=callback.from_user)
     else:
-        logger.info("Нажата кнопка Нет, просим ввести заново")
+        logger.debug("Ответ отклонён, просим ввести заново", extra={"hot": True, "question": question_num})
         
         # Не подтверждено - возвращаем к вопросу
         try:
@@ -519,18 +881,43 @@ async def confirm_answer(callback: types.CallbackQuery, state: FSMContext):
         )
         
         # Возвращаем в состояние вопроса
-        if current_state == "Test:ConfirmQ1":
-            await state.set_state(Test.Q1)
-        elif current_state == "Test:ConfirmQ2":
-            await state.set_state(Test.Q2)
-        elif current_state == "Test:ConfirmQ3":
-            await state.set_state(Test.Q3)
+        await state.set_state(Test.Answering)
     
     await callback.answer()
 
 
 # ========== TEXT ОБРАБОТЧИКИ ==========
 
+# Текст ответа админа пользователю (раньше общего текстового обработчика)
+@dp.message(admin_browser.AdminReply.Writing, F.text)
+async def process_admin_reply(message: types.Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        await state.clear()
+        return
+    
+    data = await state.get_data()
+    user_id = data.get('respond_to')
+    await state.clear()
+    
+    entry = await store.set_response(user_id, message.text)
+    if entry is None:
+        await message.answer("❌ Отправка пользователя не найдена.")
+        return
+    stats_aggregator.record_response(user_id)
+    pending_queue.discard(user_id)
+    
+    # Отправка идёт через общий планировщик с лимитами Telegram
+    try:
+        await bot.send_message(int(user_id), f"💬 Ответ администратора:\n\n{message.text}")
+        status = "✅ Ответ отправлен и сохранён."
+    except TelegramAPIError as e:
+        logger.warning(f"Не удалось доставить ответ пользователю {user_id}: {e}")
+        status = "⚠️ Ответ сохранён, но не доставлен (пользователь мог заблокировать бота)."
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[admin_browser.NEXT_PENDING_BUTTON]]) if pending_queue else None
+    await message.answer(f"{status}\n⏳ Ожидают ответа: {len(pending_queue)}", reply_markup=keyboard)
+
+
 # Обработчик ТЕКСТОВЫХ ответов
 @dp.message(F.text)
 async def process_text_answer(message: types.Message, state: FSMContext):
@@ -545,76 +932,132 @@ async def process_text_answer(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    state_map = {
-        Test.Q1: 1,
-        Test.Q2: 2,
-        Test.Q3: 3
-    }
-    question_num = state_map.get(current_state)
-    
-    if not question_num:
+    if current_state != Test.Answering.state:
         await echo_handler(message)
         return
     
+    data = await state.get_data()
+    question_num = data.get('question_num', 1)
+    
     # Показываем подтверждение вместо сразу сохранения
     await show_confirmation(message, state, question_num, message.text)
 
 
 # ========== АДМИН ФУНКЦИИ ==========
 
-async def show_all_answers(callback: types.CallbackQuery):
-    try:
-        with open('all_answers.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        await callback.message.answer("📋 Пока нет ответов.")
-        return
+# Браузер ответов: первая страница - новым сообщением, дальше редактируем его же
+async def show_all_answers(callback: types.CallbackQuery, status_key="all", page=None, anchor=None):
+    text, keyboard = await admin_browser.render_page(
+        store, status_key, page or 0, page_size=ADMIN_PAGE_SIZE, anchor=anchor
+    )
     
-    if not data:
-        await callback.message.answer("📋 Пока нет ответов.")
+    if page is None:
+        await callback.message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
         return
     
-    for user_id, answers_list in data.items():
-        latest = answers_list[-1]
-        username = latest['username']
-        timestamp = latest['timestamp']
-        
-        text = f"**📋 Ответ пользователя {user_id}**\n\n"
-        text += f"**Пользователь:** @{username}\n"
-        text += f"**Время:** {timestamp}\n\n"
-        
-        for q_num, answer in latest['answers'].items():
-            text += f"**Вопрос {q_num}:** {answer}\n\n"
-        
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(
-                    text="💬 Ответить",
-                    callback_data=f"respond_{user_id}"
-                )]
-            ]
-        )
-        
-        await callback.message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+    except Exception as e:
+        logger.warning(f"Не удалось обновить страницу ответов: {e}")
 
 
-async def show_stats(callback: types.CallbackQuery):
-    try:
-        with open('all_answers.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
+# Самая давняя отправка без ответа админа
+async def show_next_pending(callback: types.CallbackQuery):
+    while True:
+        user_id = pending_queue.peek()
+        if user_id is None:
+            await callback.message.answer("✅ Все пользователи получили ответ.")
+            return
+        found = await store.find_user(user_id)
+        if found and not found[1].get('admin_response'):
+            break
+        # Очередь разошлась с хранилищем - убираем запись и берём следующую
+        pending_queue.discard(user_id)
+    
+    _, entry = found
+    header = f"⏳ Ожидают ответа: {len(pending_queue)}\n\n"
+    await callback.message.answer(
+        header + admin_browser.format_entry(user_id, entry, max_length=admin_browser.MAX_MESSAGE_LENGTH - len(header)),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[admin_browser.respond_button(user_id, entry)]]),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+
+# Кнопки разделов статистики
+stats_menu = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📊 Сводка", callback_data="admin_stats_summary"),
+            InlineKeyboardButton(text="🔘 По вопросам", callback_data="admin_stats_choices")
+        ],
+        [
+            InlineKeyboardButton(text="📅 По дням", callback_data="admin_stats_days"),
+            InlineKeyboardButton(text="🕐 По часам", callback_data="admin_stats_hours")
+        ]
+    ]
+)
+
+
+async def show_stats(callback: types.CallbackQuery, view=None):
+    if not stats_aggregator.total_users:
         await callback.message.answer("📊 Нет данных.")
         return
     
-    total_users = len(data)
-    answered = sum(1 for answers in data.values() if answers[-1].get('admin_response'))
-    
-    text = f"**📊 Статистика**\n\n"
-    text += f"👥 Всего пользователей: {total_users}\n"
-    text += f"💬 Ответов админа: {answered}\n"
-    text += f"⏳ Ожидают ответа: {total_users - answered}\n"
+    if view == "choices":
+        text = "**🔘 Ответы по вопросам**\n\n"
+        for q_id, distribution in stats_aggregator.choice_distribution().items():
+            total = sum(count for _, count in distribution) or 1
+            text += f"**Вопрос {q_id}:**\n"
+            for option, count in distribution:
+                text += f"• {option}: {count} ({count * 100 // total}%)\n"
+            text += "\n"
+        averages = stats_aggregator.question_averages()
+        if averages:
+            text += "**🎯 Средний балл по вопросам:**\n"
+            for q_id, average in averages:
+                text += f"Вопрос {q_id}: {average * 100:.0f}%\n"
+    elif view == "days":
+        text = "**📅 Завершения по дням**\n\n"
+        for day, count in stats_aggregator.daily():
+            text += f"{day}: {count}\n"
+    elif view == "hours":
+        text = "**🕐 Завершения за 24 часа**\n\n"
+        for hour, count in stats_aggregator.hourly():
+            text += f"{hour[11:]}:00 — {count}\n"
+    else:
+        text = f"**📊 Статистика**\n\n"
+        text += f"👥 Всего пользователей: {stats_aggregator.total_users}\n"
+        text += f"📨 Всего отправок: {stats_aggregator.submissions}\n"
+        text += f"💬 Ответов админа: {stats_aggregator.answered}\n"
+        text += f"⏳ Ожидают ответа: {stats_aggregator.pending}\n"
+        if stats_aggregator.scored:
+            text += f"🎯 Средний балл: {stats_aggregator.average_score * 100:.0f}% ({stats_aggregator.scored} оценено)\n"
+            text += f"🔎 На проверку: {len(stats_aggregator.review_users)}\n"
+        text += "\n"
+        
+        if len(stats_aggregator.by_quiz) > 1:
+            text += "📝 По тестам:\n"
+            for quiz_id, count in stats_aggregator.by_quiz.most_common():
+                text += f"• {admin_browser.escape_md(quiz_id)}: {count}\n"
+            text += "\n"
+        
+        usage = await session_usage(fsm_storage)
+        if usage is not None:
+            text += f"🧠 Сессии FSM: {usage[0]} (~{usage[1] / 1024:.0f} КБ)\n"
+        
+        outbound = outbound_scheduler.snapshot()
+        text += f"📤 Исходящие: в очереди {outbound['queue_high'] + outbound['queue_low']}, "
+        text += f"ожидание ~{outbound['wait_avg_ms']:.0f} мс (макс. {outbound['wait_max_ms']:.0f} мс), "
+        text += f"повторов после 429: {outbound['retries']}\n"
     
-    await callback.message.answer(text, parse_mode=ParseMode.MARKDOWN)
+    # Первый показ - новым сообщением, переключение разделов - редактированием
+    if view is None:
+        await callback.message.answer(text, reply_markup=stats_menu, parse_mode=ParseMode.MARKDOWN)
+    else:
+        try:
+            await callback.message.edit_text(text, reply_markup=stats_menu, parse_mode=ParseMode.MARKDOWN)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статистику: {e}")
 
 
 # Обработчик любых других сообщений
@@ -626,24 +1069,139 @@ async def echo_handler(message: types.Message):
     )
 
 
-# Главная функция
-async def main():
-    logger.info("Запуск бота...")
-    logger.info(f"Загружено вопросов: {len(QUESTIONS)}")
-    logger.info(f"Версия бота: {CURRENT_VERSION}")
-    
+# Фоновые задачи, живущие всё время работы бота
+background_tasks = []
+
+
+# Метрики, которые считаются в момент запроса /metrics
+async def collect_fsm_sessions():
+    counts = await count_sessions_by_state(fsm_storage)
+    return {(state,): total for state, total in (counts or {}).items()}
+
+
+async def collect_fsm_bytes():
+    usage = await session_usage(fsm_storage)
+    return {(): usage[1]} if usage is not None else {}
+
+
+def collect_outbound_queue():
+    snapshot = outbound_scheduler.snapshot()
+    return {("high",): snapshot["queue_high"], ("low",): snapshot["queue_low"]}
+
+
+metrics.REGISTRY.gauge("bot_fsm_sessions", "Активные сессии FSM по состоянию", ("state",), collect_fsm_sessions)
+metrics.REGISTRY.gauge("bot_fsm_sessions_bytes", "Оценка объёма сессий FSM, байт", (), collect_fsm_bytes)
+metrics.REGISTRY.gauge(
+    "bot_write_queue_size", "Отправки в очереди записи", (), lambda: {(): writer.queue.qsize()}
+)
+metrics.REGISTRY.gauge(
+    "bot_outbound_queue_size", "Исходящие запросы в очереди планировщика", ("lane",), collect_outbound_queue
+)
+metrics_runner = None
+
+
+# Запуск фоновых подсистем (вызывается диспетчером и в polling, и в webhook)
+@dp.startup()
+async def on_startup():
+    await store.open()
+    await asyncio.to_thread(lifecycle.load)
+    # Индексы админ-панели и ключ оценки основного теста (чтобы первая пачка не ждала
+    # построения TF-IDF) - в фоне; запись стартует после них, отправки до этого ждут в очереди
+    warm_up.start(
+        lambda: asyncio.to_thread(load_indexes),
+        lambda: asyncio.to_thread(scoring_engine.scorer, DEFAULT_QUIZ_ID),
+        finally_=writer.start
+    )
+    background_tasks.append(asyncio.create_task(maintain_store_periodically()))
+    background_tasks.append(asyncio.create_task(config.run()))
+    background_tasks.append(asyncio.create_task(lifecycle.run()))
+    if BOT_MODE != "webhook":
+        # Обновления, обработанные прошлым процессом, сервер больше не отдаёт
+        await lifecycle.confirm(bot)
+    if session_reaper is not None:
+        background_tasks.append(asyncio.create_task(session_reaper.run()))
+    if MEDIA_PREWARM:
+        background_tasks.append(asyncio.create_task(prewarm_media_cache()))
+
+    global metrics_runner
+    if METRICS_PORT:
+        try:
+            metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик: {e}")
+
+
+# Остановка (новые обновления уже не забираются): ждём обработчики, дописываем очередь,
+# сохраняем границу обработанных обновлений и закрываем хранилища (и FSM) до закрытия сессии бота
+@dp.shutdown()
+async def on_shutdown():
+    await lifecycle.drain()
+    # Воркер записи запускается прогревом: без него очередь не дописать
+    await warm_up.wait()
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await writer.stop()
+    # Сводка по последним завершениям уходит до закрытия планировщика и сессии
+    await admin_digest.close()
+    await store.close()
+    try:
+        await asyncio.to_thread(lifecycle.save)
+    except OSError as e:
+        logger.error(f"Не удалось сохранить границу обновлений: {e}")
+    if BOT_MODE != "webhook":
+        await lifecycle.confirm(bot)
+    await dp.fsm.close()
+    await outbound_scheduler.close()
+
+
+async def run_polling():
     try:
         await bot.delete_webhook()
     except Exception as e:
         logger.warning(f"Не удалось удалить webhook: {e}")
     
+    # SIGTERM/SIGINT обрабатывает диспетчер: перестаёт забирать обновления и вызывает on_shutdown
     try:
-        await dp.start_polling(bot)
+        await dp.start_polling(bot, handle_signals=True)
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
         await bot.session.close()
 
 
+# Главная функция
+async def main():
+    logger.info("Запуск бота...")
+    logger.info(f"Загружено вопросов: {config.quiz.total}")
+    logger.info(f"Версия бота: {CURRENT_VERSION}")
+    
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_BASE_URL:
+            raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_BASE_URL!")
+        # Без секрета любой может прислать на /webhook поддельное обновление от имени админа
+        if not WEBHOOK_SECRET:
+            raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_SECRET!")
+        # Журнал all_answers.jsonl пишет и компактирует только один процесс
+        if STORAGE_BACKEND == "file":
+            raise ValueError("Для BOT_MODE=webhook нужен STORAGE_BACKEND=sqlite!")
+        # aiohttp.web нужен только в режиме webhook
+        from webhook_server import run_webhook
+        await run_webhook(
+            bot, dp,
+            base_url=WEBHOOK_BASE_URL,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            host=WEB_HOST,
+            port=WEB_PORT,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            health_info=lambda: {"version": CURRENT_VERSION, "write_queue": writer.queue.qsize()}
+        )
+    else:
+        await run_polling()
+
+
 if __name__ == "__main__":
     asyncio.run(main())
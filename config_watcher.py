@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from quiz import Quiz, questions_version
+from quiz_catalog import MAX_VERSIONS
+
+logger = logging.getLogger(__name__)
+
+
+# Следит за questions.json и versions/ и подменяет снимки конфигурации без перезапуска
+class ConfigWatcher:
+    """Снимок теста неизменяем; сессия хранит версию снимка, с которой начала тест"""
+
+    def __init__(self, questions_path="questions.json", versions_dir="versions", interval=5):
+        self.questions_path = questions_path
+        self.versions_dir = versions_dir
+        self.interval = interval
+        self.quiz = Quiz([])
+        self.quiz_version = None
+        # Последние MAX_VERSIONS снимков для уже начатых сессий: версия -> Quiz
+        self.quizzes = OrderedDict()
+        self.version_info = None
+        # Вызываются с новым Quiz после каждой смены вопросов
+        self.listeners = []
+        self._questions_fingerprint = None
+        self._versions_fingerprint = None
+
+    def load(self):
+        self._notify(self.check())
+        return self
+
+    # Тест для сессии: её снимок, а если он неизвестен (например, после перезапуска) - текущий
+    def get_quiz(self, version):
+        return self.quizzes.get(version, self.quiz)
+
+    # Публикация нового набора вопросов
+    def set_questions(self, questions):
+        quiz = self._publish(questions)
+        self._notify(quiz)
+        return quiz
+
+    # id вопросов текущей версии, затем вопросов из удерживаемых прежних версий
+    def known_question_ids(self):
+        question_ids = list(self.quiz.question_ids)
+        for quiz in reversed(self.quizzes.values()):
+            question_ids.extend(q_id for q_id in quiz.question_ids if q_id not in question_ids)
+        return question_ids
+
+    def _publish(self, questions):
+        version = questions_version(questions)
+        quiz = self.quizzes.get(version) or Quiz(questions)
+        self.quizzes[version] = quiz
+        self.quizzes.move_to_end(version)
+        while len(self.quizzes) > MAX_VERSIONS:
+            self.quizzes.popitem(last=False)
+        # Ссылки на снимок и версию меняются вместе, читатели видят либо старую пару, либо новую
+        self.quiz, self.quiz_version = quiz, version
+        return quiz
+
+    def _notify(self, quiz):
+        if quiz is None:
+            return
+        for listener in self.listeners:
+            listener(quiz)
+
+    def _read_questions(self):
+        try:
+            with open(self.questions_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                return data.get('questions', [])
+        except FileNotFoundError:
+            logger.error(f"Файл {self.questions_path} не найден!")
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка чтения {self.questions_path}!")
+        return None
+
+    def _read_version_info(self, version_files):
+        if not version_files:
+            return None
+        latest_version_file = os.path.join(self.versions_dir, version_files[-1])
+        try:
+            with open(latest_version_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logger.error(f"Ошибка чтения {latest_version_file}")
+            return None
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    # Сравнение mtime и перезагрузка изменившегося; возвращает новый Quiz, если вопросы сменились
+    def check(self):
+        changed_quiz = None
+        previous = self.quiz_version
+
+        fingerprint = self._mtime(self.questions_path)
+        if fingerprint != self._questions_fingerprint:
+            self._questions_fingerprint = fingerprint
+            questions = self._read_questions()
+            # Битый файл не должен сбрасывать уже загруженные вопросы
+            if questions is not None:
+                changed_quiz = self._publish(questions)
+                if previous == self.quiz_version:
+                    # Файл тронули, но содержимое то же
+                    changed_quiz = None
+                elif previous is not None:
+                    logger.info(f"Вопросы перезагружены: версия {self.quiz_version}, вопросов {changed_quiz.total}")
+
+        if os.path.isdir(self.versions_dir):
+            version_files = sorted(f for f in os.listdir(self.versions_dir) if f.endswith('.json'))
+            fingerprint = tuple((f, self._mtime(os.path.join(self.versions_dir, f))) for f in version_files)
+        else:
+            version_files, fingerprint = [], None
+        if fingerprint != self._versions_fingerprint:
+            self._versions_fingerprint = fingerprint
+            self.version_info = self._read_version_info(version_files)
+
+        return changed_quiz
+
+    # Фоновая проверка изменений
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # Файлы читаются в рабочем потоке, подписчики уведомляются в event loop
+                self._notify(await asyncio.to_thread(self.check))
+            except Exception as e:
+                logger.error(f"Ошибка перезагрузки конфигурации: {e}")
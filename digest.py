@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Сколько пользователей перечислять в одной сводке
+MAX_LISTED = 10
+
+
+# Сводка для админа: завершения копятся window секунд или до max_items штук и уходят одним сообщением
+class AdminDigest:
+    def __init__(self, send, window=60, max_items=50):
+        # send(items, started_at) - корутина, которая отправляет сводку
+        self.send = send
+        self.window = window
+        self.max_items = max_items
+        self.items = []
+        self.started_at = None
+        self._timer = None
+        # Сводки, запущенные по max_items: add() их не ждёт, close() дожидается
+        self._flushes = set()
+        self._lock = asyncio.Lock()
+
+    async def add(self, items):
+        if not self.items:
+            self.started_at = time.time()
+        self.items.extend(items)
+        if len(self.items) >= self.max_items:
+            # Отправка идёт с темпом чата админа - не задерживаем того, кто добавляет
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        # Отправки сводок не должны перекрываться и терять элементы
+        async with self._lock:
+            if self._timer is not None and self._timer is not asyncio.current_task():
+                self._timer.cancel()
+                self._timer = None
+            items, self.items = self.items, []
+            if not items:
+                return
+            try:
+                await self.send(items, self.started_at)
+            except Exception as e:
+                logger.error(f"Не удалось отправить сводку админу ({len(items)} ответов): {e}")
+
+    # Остановка: отправляем то, что накопилось
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+
+# Текст сводки
+def format_digest(items, started_at=None, link=None):
+    text = f"🔔 Новых ответов на тест: {len(items)}"
+    if started_at:
+        elapsed = max(int(time.time() - started_at), 1)
+        text += f" за {elapsed} с" if elapsed < 60 else f" за {round(elapsed / 60)} мин."
+    text += "\n\n"
+    for item in items[:MAX_LISTED]:
+        text += f"• @{item['mention']} (ID: {item['user_id']})\n"
+    if len(items) > MAX_LISTED:
+        text += f"…и ещё {len(items) - MAX_LISTED}\n"
+    if link:
+        text += f"\n📋 Ждут ответа: {link}"
+    return text
@@ -0,0 +1,153 @@
+import asyncio
+import csv
+import gzip
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from quiz import DEFAULT_QUIZ_ID
+from storage import entry_quiz_id, needs_review
+
+FORMATS = ("csv", "csv.gz", "xlsx")
+
+# Лимит Bot API на отправку документа ботом
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+USAGE = (
+    "📤 Использование:\n"
+    "/export [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] [quiz=id|default] [q=1,3] [status=pending|answered|review] [format=csv|csv.gz|xlsx]\n\n"
+    "Например: /export from=2026-02-01 status=pending format=csv.gz"
+)
+
+
+# Разбор аргументов команды /export; при ошибке - ValueError с текстом для админа
+# question_ids остаётся None, если q= не задан: колонки берутся из выбранного теста.
+# Без quiz= выгружается основной тест: строки и колонки всегда от одного теста
+def parse_export_args(text):
+    filters = {
+        "since": None,
+        "until": None,
+        "quiz_id": DEFAULT_QUIZ_ID,
+        "question_ids": None,
+        "status": None,
+        "format": "csv.gz"
+    }
+    for arg in text.split()[1:]:
+        key, sep, value = arg.partition('=')
+        if not sep or not value:
+            raise ValueError(f"Непонятный параметр: {arg}")
+        if key in ("from", "to"):
+            try:
+                day = datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Дата должна быть в формате ГГГГ-ММ-ДД: {value}")
+            if key == "from":
+                filters["since"] = day.strftime("%Y-%m-%d %H:%M:%S")
+            else:
+                # Дата "по" включительно
+                filters["until"] = (day + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+        elif key == "quiz":
+            filters["quiz_id"] = value
+        elif key == "q":
+            filters["question_ids"] = [q_id.strip() for q_id in value.split(',') if q_id.strip()]
+        elif key == "status":
+            if value not in ("pending", "answered", "review"):
+                raise ValueError("status может быть pending, answered или review")
+            filters["status"] = value
+        elif key == "format":
+            if value not in FORMATS:
+                raise ValueError(f"format может быть: {', '.join(FORMATS)}")
+            filters["format"] = value
+        else:
+            raise ValueError(f"Неизвестный параметр: {key}")
+    return filters
+
+
+# Строки выгрузки: генератор поверх потока отправок, в памяти только текущая пачка
+def export_rows(submissions, question_ids, status=None, quiz_id=None):
+    for user_id, entry in submissions:
+        if quiz_id and entry_quiz_id(entry) != quiz_id:
+            continue
+        answered = bool(entry.get('admin_response'))
+        if status == "pending" and answered:
+            continue
+        if status == "answered" and not answered:
+            continue
+        if status == "review" and not needs_review(entry):
+            continue
+        row = [user_id, entry['username'], entry['timestamp'], entry_quiz_id(entry)]
+        row.extend(entry['answers'].get(q_id, "") for q_id in question_ids)
+        score = entry.get('score')
+        row.append(score['total'] if score else "")
+        row.append(entry.get('admin_response') or "")
+        yield row
+
+
+def export_header(question_ids):
+    return ["user_id", "username", "timestamp", "quiz_id"] + [f"Q{q_id}" for q_id in question_ids] + ["score", "admin_response"]
+
+
+def _write_csv(rows, header, path, compress):
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _write_xlsx(rows, header, path):
+    # openpyxl - необязательная зависимость, нужна только для xlsx
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("Для xlsx нужен пакет openpyxl, используйте format=csv.gz")
+
+    # write_only: строки сразу уходят в файл и не копятся в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("results")
+    sheet.append(header)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+# Выгрузка во временный файл в рабочем потоке; возвращает (путь, имя файла, число строк).
+# Файл, который Telegram не примет, удаляется - ValueError с подсказкой, как сузить выгрузку
+async def export_to_file(store, filters):
+    extension = filters["format"]
+    filename = f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    fd, path = tempfile.mkstemp(suffix="." + extension)
+    os.close(fd)
+
+    def write():
+        submissions = store.iter_submissions(since=filters["since"], until=filters["until"])
+        rows = export_rows(submissions, filters["question_ids"], filters["status"], filters["quiz_id"])
+        header = export_header(filters["question_ids"])
+        if extension == "xlsx":
+            return _write_xlsx(rows, header, path)
+        return _write_csv(rows, header, path, compress=extension == "csv.gz")
+
+    try:
+        count = await asyncio.to_thread(write)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    size = os.path.getsize(path)
+    if size > MAX_DOCUMENT_SIZE:
+        os.remove(path)
+        hint = "сузьте выгрузку: from=, to=, quiz=, status= или q="
+        if extension != "csv.gz":
+            hint += ", либо используйте format=csv.gz"
+        raise ValueError(
+            f"Файл выгрузки ({size / 1024 / 1024:.0f} МБ, строк: {count}) больше лимита Telegram "
+            f"{MAX_DOCUMENT_SIZE // 1024 // 1024} МБ — {hint}"
+        )
+    return path, filename, count
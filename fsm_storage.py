@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from copy import copy
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+# Оценка накладных расходов на одну сессию в памяти сверх самих данных (ключ, запись, словари), байт
+SESSION_OVERHEAD = 600
+
+
+# MemoryStorage с отметкой последнего обращения и TTL
+class TimedMemoryStorage(MemoryStorage):
+    """Сессии упорядочены по последнему обращению, поэтому истёкшие снимаются с начала без полного обхода.
+    Число сессий по состояниям и оценка объёма ведутся при записи, а не считаются обходом"""
+
+    def __init__(self, ttl=None):
+        super().__init__()
+        self.ttl = ttl
+        # StorageKey -> время последнего обращения (time.time()), от давних к недавним
+        self.touched = OrderedDict()
+        # StorageKey -> (состояние, оценка объёма) на момент последней записи
+        self._accounted = {}
+        self.state_counts = Counter()
+        self.total_size = 0
+
+    def _touch(self, key):
+        self.touched[key] = time.time()
+        self.touched.move_to_end(key)
+
+    def _drop(self, key):
+        self.storage.pop(key, None)
+        self.touched.pop(key, None)
+        self._account(key)
+
+    # Пересчёт вклада сессии в счётчики; data_changed=False - данные не менялись, размер прежний
+    def _account(self, key, data_changed=True):
+        old = self._accounted.pop(key, None)
+        if old is not None:
+            self.state_counts[old[0]] -= 1
+            if not self.state_counts[old[0]]:
+                del self.state_counts[old[0]]
+            self.total_size -= old[1]
+        record = self.storage.get(key)
+        if record is None:
+            return
+        if data_changed or old is None:
+            size = len(json.dumps(record.data, ensure_ascii=False, default=str).encode()) + SESSION_OVERHEAD
+        else:
+            size = old[1]
+        state = record.state or "none"
+        self._accounted[key] = (state, size)
+        self.state_counts[state] += 1
+        self.total_size += size
+
+    # Живая запись или None; чтение не создаёт пустых записей, в отличие от MemoryStorage
+    def _record(self, key):
+        record = self.storage.get(key)
+        if record is None:
+            return None
+        if self.ttl and time.time() - self.touched.get(key, 0) > self.ttl:
+            self._drop(key)
+            return None
+        self._touch(key)
+        return record
+
+    # После записи: пустая сессия не хранится
+    def _after_write(self, key, data_changed=True):
+        record = self.storage[key]
+        if record.state is None and not record.data:
+            self._drop(key)
+        else:
+            self._touch(key)
+            self._account(key, data_changed)
+
+    async def set_state(self, key, state=None):
+        if self._record(key) is None and state is None:
+            return
+        await super().set_state(key, state)
+        self._after_write(key, data_changed=False)
+
+    async def get_state(self, key):
+        record = self._record(key)
+        return record.state if record else None
+
+    async def set_data(self, key, data):
+        if self._record(key) is None and not data:
+            return
+        await super().set_data(key, data)
+        self._after_write(key)
+
+    async def get_data(self, key):
+        record = self._record(key)
+        return record.data.copy() if record else {}
+
+    async def get_value(self, storage_key, dict_key, default=None):
+        record = self._record(storage_key)
+        return copy(record.data.get(dict_key, default)) if record else default
+
+    # Удаление истёкших сессий (не больше batch_size за вызов), возвращает количество удалённых
+    async def cleanup_expired(self, batch_size=1000):
+        if not self.ttl:
+            return 0
+        expired_before = time.time() - self.ttl
+        removed = 0
+        while self.touched and removed < batch_size:
+            key, touched_at = next(iter(self.touched.items()))
+            if touched_at >= expired_before:
+                break
+            self._drop(key)
+            removed += 1
+        return removed
+
+    # Сессии, к которым не обращались с idle_since, но позже after: [(chat_id, state, data, время), ...]
+    async def idle_sessions(self, idle_since, after, limit):
+        sessions = []
+        for key, touched_at in self.touched.items():
+            if touched_at > idle_since or len(sessions) >= limit:
+                break
+            if touched_at > after:
+                record = self.storage[key]
+                sessions.append((key.chat_id, record.state, record.data.copy(), touched_at))
+        return sessions
+
+    # Число сессий и оценка занимаемой ими памяти в байтах
+    async def usage(self):
+        return len(self.storage), self.total_size
+
+    # {состояние: число сессий}
+    async def count_by_state(self):
+        return dict(self.state_counts)
+
+
+# FSM-хранилище в SQLite: сессии теста переживают перезапуск бота
+class SQLiteStorage(BaseStorage):
+    """Состояние и данные FSM в одной таблице, записи старше ttl считаются истёкшими"""
+
+    def __init__(self, path="fsm.db", ttl=None, key_builder=None):
+        self.path = path
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS fsm (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm(updated_at);
+            """)
+            self.conn.commit()
+        return self.conn
+
+    async def _run(self, func, *args):
+        def call():
+            with self._lock:
+                return func(self._connect(), *args)
+        return await asyncio.to_thread(call)
+
+    def _alive_since(self):
+        return time.time() - self.ttl if self.ttl else 0
+
+    def _read(self, conn, key, column):
+        row = conn.execute(
+            f"SELECT {column} FROM fsm WHERE key = ? AND updated_at >= ?", (key, self._alive_since())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, conn, key, column, value):
+        with conn:
+            # Истёкшая сессия не должна "воскреснуть" частично
+            conn.execute("DELETE FROM fsm WHERE key = ? AND updated_at < ?", (key, self._alive_since()))
+            conn.execute(
+                f"INSERT INTO fsm (key, {column}, updated_at) VALUES (?, ?, ?) "
+                f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, updated_at = excluded.updated_at",
+                (key, value, time.time())
+            )
+            # Пустая сессия не нужна
+            conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+    async def set_state(self, key, state=None):
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._write, self.key_builder.build(key), "state", value)
+
+    async def get_state(self, key):
+        return await self._run(self._read, self.key_builder.build(key), "state")
+
+    async def set_data(self, key, data):
+        await self._run(self._write, self.key_builder.build(key), "data", json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key):
+        data = await self._run(self._read, self.key_builder.build(key), "data")
+        return json.loads(data) if data else {}
+
+    # Удаление истёкших сессий (не больше batch_size за вызов), возвращает количество удалённых
+    async def cleanup_expired(self, batch_size=1000):
+        if not self.ttl:
+            return 0
+
+        def delete(conn):
+            with conn:
+                return conn.execute(
+                    "DELETE FROM fsm WHERE key IN (SELECT key FROM fsm WHERE updated_at < ? LIMIT ?)",
+                    (self._alive_since(), batch_size)
+                ).rowcount
+        return await self._run(delete)
+
+    # Сессии, к которым не обращались с idle_since, но позже after: [(chat_id, state, data, время), ...]
+    async def idle_sessions(self, idle_since, after, limit):
+        def query(conn):
+            rows = conn.execute(
+                "SELECT key, state, data, updated_at FROM fsm WHERE updated_at > ? AND updated_at <= ? "
+                "ORDER BY updated_at LIMIT ?",
+                (max(after, self._alive_since()), idle_since, limit)
+            ).fetchall()
+            # Ключ DefaultKeyBuilder: fsm:<chat_id>:<user_id>:<destiny>
+            return [(int(key.split(':')[1]), state, json.loads(data), updated_at) for key, state, data, updated_at in rows]
+        return await self._run(query)
+
+    # Число живых сессий и объём их данных в базе, байт
+    async def usage(self):
+        def query(conn):
+            return tuple(conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length(key) + length(data) + COALESCE(length(state), 0)), 0) "
+                "FROM fsm WHERE updated_at >= ?", (self._alive_since(),)
+            ).fetchone())
+        return await self._run(query)
+
+    # Живые сессии по состояниям: {state: количество}
+    async def count_by_state(self):
+        def count(conn):
+            rows = conn.execute(
+                "SELECT state, COUNT(*) FROM fsm WHERE updated_at >= ? GROUP BY state", (self._alive_since(),)
+            ).fetchall()
+            return {state or "none": total for state, total in rows}
+        return await self._run(count)
+
+    async def close(self):
+        if self.conn is not None:
+            await asyncio.to_thread(self.conn.close)
+            self.conn = None
+
+
+# Создание FSM-хранилища по имени бэкенда (FSM_STORAGE)
+def create_fsm_storage(backend="memory", sqlite_path="fsm.db", redis_url=None, ttl=None):
+    if backend == "memory":
+        return TimedMemoryStorage(ttl=ttl)
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path, ttl=ttl)
+    if backend == "redis":
+        # Нужен пакет redis; для локальной проверки подойдёт любой сервер с протоколом Redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            redis_url or "redis://localhost:6379/0",
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=ttl,
+            data_ttl=ttl
+        )
+    raise ValueError(f"Неизвестный FSM_STORAGE: {backend}")
+
+
+# Количество сессий по состояниям для метрик; None, если бэкенд не умеет их перечислять
+async def count_sessions_by_state(storage):
+    if isinstance(storage, (SQLiteStorage, TimedMemoryStorage)):
+        return await storage.count_by_state()
+    if isinstance(storage, MemoryStorage):
+        counts = {}
+        for record in storage.storage.values():
+            if record.state is None and not record.data:
+                continue
+            state = record.state or "none"
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+    return None
+
+
+# Число сессий и оценка их объёма в байтах; None, если бэкенд не умеет их перечислять (Redis)
+async def session_usage(storage):
+    usage = getattr(storage, "usage", None)
+    return await usage() if usage else None
+
+
+# Изоляция событий одного пользователя между воркерами (для Redis - распределённая блокировка)
+def create_events_isolation(storage):
+    create_isolation = getattr(storage, "create_isolation", None)
+    return create_isolation() if create_isolation else None
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import os
+
+from aiogram import BaseMiddleware
+
+from metrics import updates_dropped_total
+
+logger = logging.getLogger(__name__)
+
+# Повтором считаются только update_id не дальше этого от сохранённой границы: Telegram
+# начинает нумерацию заново со случайного значения, если обновлений не было около недели
+REPLAY_WINDOW = 100000
+
+
+# Внешний middleware на dp.update: обработчики в работе и граница полностью обработанных update_id
+class UpdateLifecycle(BaseMiddleware):
+    """Граница сохраняется в файл и подтверждается в Telegram, поэтому следующий процесс
+    не получает повторно уже обработанные обновления. offset_path=None (webhook, несколько
+    процессов) - граница не загружается и не сохраняется, повторы не отсеиваются"""
+
+    def __init__(self, offset_path="polling_offset.json", drain_timeout=20):
+        self.offset_path = offset_path
+        self.drain_timeout = drain_timeout
+        # update_id, которые сейчас обрабатываются
+        self.in_flight = set()
+        self.last_finished = None
+        # Граница из прошлого запуска: всё, что не больше неё, уже обработано.
+        # Сбрасывается при первом обновлении, которое точно не повтор
+        self.loaded = None
+        self.saved = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def load(self):
+        if self.offset_path is None:
+            return self
+        try:
+            with open(self.offset_path, 'r', encoding='utf-8') as f:
+                self.loaded = self.saved = json.load(f)['update_id']
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logger.error(f"Ошибка чтения {self.offset_path}, граница обновлений сброшена")
+        return self
+
+    # Наибольший update_id, до которого включительно всё обработано. Обработка начинается
+    # в порядке update_id, поэтому всё меньше самого раннего незавершённого уже закончено
+    @property
+    def watermark(self):
+        if self.in_flight:
+            return min(self.in_flight) - 1
+        if self.last_finished is None:
+            return self.loaded
+        return self.last_finished
+
+    async def __call__(self, handler, event, data):
+        update_id = event.update_id
+        if self.loaded is not None:
+            if self.loaded - REPLAY_WINDOW < update_id <= self.loaded:
+                # Повторная доставка после перезапуска - обработано прошлым процессом
+                updates_dropped_total.inc("replay")
+                return None
+            # Новое обновление (или нумерация началась заново) - повторов дальше не будет
+            if update_id < self.loaded:
+                logger.warning(f"Нумерация обновлений началась заново: {update_id} после {self.loaded}")
+            self.loaded = None
+
+        self.in_flight.add(update_id)
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight.discard(update_id)
+            last = self.last_finished
+            # Сильно меньший update_id - нумерация началась заново, граница идёт за ней
+            if last is None or update_id > last or update_id <= last - REPLAY_WINDOW:
+                self.last_finished = update_id
+            if not self.in_flight:
+                self._idle.set()
+
+    # Ожидание текущих обработчиков; False, если не уложились в drain_timeout.
+    # Незавершённые обновления теряются: aiogram уже подтвердил их следующим getUpdates
+    async def drain(self):
+        if not self.in_flight:
+            return True
+        logger.info(f"Ждём завершения обработчиков: {len(self.in_flight)}")
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались обработчиков за {self.drain_timeout} с, прерваны: {sorted(self.in_flight)}")
+            return False
+
+    # Атомарная запись границы: временный файл и переименование
+    def save(self):
+        watermark = self.watermark
+        if self.offset_path is None or watermark is None or watermark == self.saved:
+            return
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"update_id": watermark}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+        self.saved = watermark
+
+    # Периодическое сохранение: после аварийного падения повторится не больше interval секунд обновлений
+    async def run(self, interval=5):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.save)
+            except OSError as e:
+                logger.error(f"Не удалось сохранить границу обновлений: {e}")
+
+    # Подтверждение границы в Telegram (только long polling): getUpdates с offset помечает
+    # все обновления до него полученными, и сервер больше их не отдаёт
+    async def confirm(self, bot):
+        watermark = self.watermark
+        if watermark is None:
+            return
+        try:
+            await bot.get_updates(offset=watermark + 1, limit=1, timeout=0)
+        except Exception as e:
+            logger.warning(f"Не удалось подтвердить обновления до {watermark}: {e}")
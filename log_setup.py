@@ -0,0 +1,96 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Поля записи, которые есть у любого LogRecord; всё остальное пришло через extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+# Поля extra с ответами пользователей и админа
+REDACTED_FIELDS = ("answer", "answers", "response")
+
+# Логгеры, которые пишут на каждое обновление
+HOT_LOGGERS = ("aiogram.event",)
+
+
+# JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact=True):
+        super().__init__()
+        self.redact = redact
+
+    def _value(self, key, value):
+        if self.redact and key in REDACTED_FIELDS and value is not None:
+            return f"<скрыто, {len(str(value))} симв.>"
+        return value
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key != "hot":
+                payload[key] = self._value(key, value)
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+# Обычный текстовый формат, но с той же маскировкой ответов
+class TextFormatter(logging.Formatter):
+    def __init__(self, redact=True):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.redact = redact
+
+    def format(self, record):
+        text = super().format(record)
+        extra = {
+            key: (f"<скрыто, {len(str(value))} симв.>" if self.redact and key in REDACTED_FIELDS else value)
+            for key, value in vars(record).items()
+            if key not in _RECORD_FIELDS and key != "hot"
+        }
+        return f"{text} {extra}" if extra else text
+
+
+# Пропускает только долю "горячих" записей (extra hot=True или логгеры из HOT_LOGGERS)
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=1.0, hot_loggers=HOT_LOGGERS):
+        super().__init__()
+        self.rate = rate
+        self.hot_loggers = hot_loggers
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        if getattr(record, "hot", False) or record.name in self.hot_loggers:
+            return random.random() < self.rate
+        return True
+
+
+# Логи через очередь: в event loop только постановка записи, вывод - в фоновом потоке
+def setup_logging(level="INFO", json_format=True, sample_rate=1.0, redact=True, stream=None):
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter(redact) if json_format else TextFormatter(redact))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # Дописываем хвост очереди при выходе из процесса
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Кэш file_id, которые Telegram вернул после первой загрузки картинки
+class MediaCache:
+    """Ключ - путь + хэш содержимого, так что изменённый файл загрузится заново.
+    Файл картинки проверяется не чаще раза в check_interval секунд, как и questions.json"""
+
+    def __init__(self, path="media_cache.json", check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self.file_ids = {}
+        # путь -> ((mtime_ns, size), хэш, время проверки), чтобы не считать хэш и не делать stat на каждой отправке
+        self._fingerprints = {}
+        self._save_lock = asyncio.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.file_ids = json.load(f)
+        except FileNotFoundError:
+            self.file_ids = {}
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка чтения {self.path}, кэш медиа сброшен")
+            self.file_ids = {}
+        return self
+
+    def _write(self, file_ids):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(file_ids, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    # Запись с fsync - в рабочем потоке; записи идут по очереди, каждая со снимком на свой момент
+    async def _save(self):
+        async with self._save_lock:
+            try:
+                await asyncio.to_thread(self._write, dict(self.file_ids))
+            except OSError as e:
+                logger.error(f"Не удалось сохранить {self.path}: {e}")
+
+    # Ключ кэша для файла; stat - не чаще check_interval, хэш - только если поменялись mtime или размер
+    def key(self, file_path):
+        now = time.monotonic()
+        cached = self._fingerprints.get(file_path)
+        if cached is not None and now - cached[2] < self.check_interval:
+            return f"{file_path}:{cached[1]}"
+        stat = os.stat(file_path)
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        if cached is None or cached[0] != fingerprint:
+            with open(file_path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        else:
+            digest = cached[1]
+        self._fingerprints[file_path] = (fingerprint, digest, now)
+        return f"{file_path}:{digest}"
+
+    def get(self, file_path):
+        return self.file_ids.get(self.key(file_path))
+
+    async def put(self, file_path, file_id):
+        key = self.key(file_path)
+        # Старые file_id этого же пути больше не нужны
+        prefix = f"{file_path}:"
+        for old_key in [k for k in self.file_ids if k.startswith(prefix) and k != key]:
+            del self.file_ids[old_key]
+        self.file_ids[key] = file_id
+        await self._save()
+
+    # file_id перестал работать (например, сменился токен бота)
+    async def forget(self, file_path):
+        if self.file_ids.pop(self.key(file_path), None) is not None:
+            await self._save()
@@ -0,0 +1,199 @@
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+# Счётчик в формате Prometheus
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = defaultdict(float)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+# Гистограмма длительностей в формате Prometheus
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label_values -> [счётчики по корзинам..., +Inf], сумма
+        self.counts = {}
+        self.sums = defaultdict(float)
+
+    def observe(self, value, *label_values):
+        counts = self.counts.get(label_values)
+        if counts is None:
+            counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {self.sums[label_values]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# Gauge, значение которого вычисляется в момент запроса /metrics
+class GaugeCallback:
+    def __init__(self, name, documentation, labels, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # collect() -> {(значения меток...): число}, может быть корутиной
+        self.collect = collect
+
+    async def render(self):
+        values = self.collect()
+        if inspect.isawaitable(values):
+            values = await values
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.collectors = []
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, labels, collect):
+        return self.register(GaugeCallback(name, documentation, labels, collect))
+
+    async def render(self):
+        lines = []
+        for collector in self.collectors:
+            try:
+                rendered = collector.render()
+                if inspect.isawaitable(rendered):
+                    rendered = await rendered
+            except Exception as e:
+                logger.error(f"Не удалось собрать метрику {collector.name}: {e}")
+                continue
+            lines.extend(rendered)
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр метрик процесса
+REGISTRY = Registry()
+
+updates_total = REGISTRY.counter("bot_updates_total", "Входящие обновления по типу", ("type",))
+updates_dropped_total = REGISTRY.counter(
+    "bot_updates_dropped_total", "Обновления, отброшенные анти-флудом", ("reason",)
+)
+update_seconds = REGISTRY.histogram("bot_update_seconds", "Полное время обработки обновления", ("type",))
+handler_seconds = REGISTRY.histogram("bot_handler_seconds", "Время работы обработчика", ("handler",))
+handler_errors_total = REGISTRY.counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+storage_write_seconds = REGISTRY.histogram("bot_storage_write_seconds", "Длительность записи в хранилище", ("target",))
+api_request_seconds = REGISTRY.histogram("bot_api_request_seconds", "Длительность запросов к Bot API", ("method",))
+api_errors_total = REGISTRY.counter("bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+fsm_sessions_expired_total = REGISTRY.counter("bot_fsm_sessions_expired_total", "Сессии FSM, удалённые по TTL")
+fsm_reminders_total = REGISTRY.counter("bot_fsm_reminders_total", "Напоминания о незавершённом тесте")
+
+
+# Внешний middleware на dp.update: число и длительность обновлений по типу
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        update_type = event.event_type
+        updates_total.inc(update_type)
+        with update_seconds.time(update_type):
+            return await handler(event, data)
+
+
+# Внутренний middleware на наблюдателях: длительность конкретного обработчика
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        with handler_seconds.time(name):
+            try:
+                return await handler(event, data)
+            except Exception:
+                handler_errors_total.inc(name)
+                raise
+
+
+# Middleware сессии бота: длительность и ошибки запросов к Telegram
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        method_name = type(method).__name__
+        with api_request_seconds.time(method_name):
+            try:
+                return await make_request(bot, method)
+            except Exception as e:
+                api_errors_total.inc(method_name, type(e).__name__)
+                raise
+
+
+# Локальный HTTP-сервер с /metrics
+async def start_metrics_server(host="127.0.0.1", port=9100, registry=REGISTRY):
+    # aiohttp.web импортируется только здесь: без METRICS_PORT он не нужен и не замедляет старт
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=await registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: ответы пользователям идут раньше массовых админских рассылок
+HIGH = 0
+LOW = 1
+
+_priority = contextvars.ContextVar("outbound_priority", default=HIGH)
+
+
+# Всё, что отправляется внутри блока, идёт в низкоприоритетной полосе
+@contextmanager
+def bulk():
+    token = _priority.set(LOW)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# Token bucket с резервированием: возвращает, сколько ждать до своего токена
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    # Взять токен, только если он есть прямо сейчас
+    def try_take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, seconds, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated = now
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+# Центральный планировщик исходящих запросов (middleware сессии бота)
+class OutboundScheduler(BaseRequestMiddleware):
+    """Глобальный лимит + лимит на чат, приоритеты и автоматический повтор после 429"""
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, group_rate=20 / 60,
+                 max_retries=3, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.chats = OrderedDict()
+        self.lanes = (deque(), deque())
+        self._wakeup = None
+        self._pump = None
+        # Метрики
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery и т.п. не попадают под лимиты сообщений
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retries += 1
+                logger.warning(f"429 в чате {chat_id}, повтор через {e.retry_after} с")
+                self._chat_bucket(chat_id).pause(e.retry_after)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.max_chats:
+                self._evict()
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chats[chat_id] = bucket
+        else:
+            self.chats.move_to_end(chat_id)
+        return bucket
+
+    # Выбрасываем давно неактивные чаты (их ведро и так полное)
+    def _evict(self):
+        now = time.monotonic()
+        for chat_id in list(self.chats)[:max(len(self.chats) // 10, 1)]:
+            if self.chats[chat_id].is_full(now):
+                del self.chats[chat_id]
+        while len(self.chats) >= self.max_chats:
+            self.chats.popitem(last=False)
+
+    async def _acquire(self, chat_id, priority):
+        started = time.monotonic()
+
+        # Сначала лимит конкретного чата, потом общая очередь с приоритетами
+        delay = self._chat_bucket(chat_id).reserve(started)
+        if delay:
+            await asyncio.sleep(delay)
+
+        future = asyncio.get_running_loop().create_future()
+        self.lanes[priority].append(future)
+        self._ensure_pump()
+        self._wakeup.set()
+        await future
+
+        waited = time.monotonic() - started
+        self.waits += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def _ensure_pump(self):
+        if self._pump is None or self._pump.done():
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.create_task(self._run_pump())
+
+    # Выдаёт глобальные токены: сначала полосе HIGH, затем LOW
+    async def _run_pump(self):
+        while True:
+            lane = self.lanes[HIGH] or self.lanes[LOW]
+            if not lane:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self.global_bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+            lane = self.lanes[HIGH] or self.lanes[LOW]
+            while lane:
+                future = lane.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def close(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            self._pump = None
+
+    # Метрики для админ-панели
+    def snapshot(self):
+        return {
+            "queue_high": len(self.lanes[HIGH]),
+            "queue_low": len(self.lanes[LOW]),
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "wait_avg_ms": self.wait_total / self.waits * 1000 if self.waits else 0.0,
+            "wait_max_ms": self.wait_max * 1000
+        }
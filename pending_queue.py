@@ -0,0 +1,55 @@
+import heapq
+import itertools
+
+
+# Очередь пользователей, ждущих ответа админа, от самых давних к новым
+class PendingQueue:
+    """Куча по времени отправки с ленивым удалением: добавление и "следующий" - O(log n)"""
+
+    def __init__(self):
+        self._heap = []
+        # user_id -> (timestamp, seq) актуальной записи в куче
+        self._current = {}
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._current)
+
+    def __contains__(self, user_id):
+        return str(user_id) in self._current
+
+    def push(self, user_id, timestamp):
+        user_id = str(user_id)
+        key = (timestamp, next(self._seq))
+        self._current[user_id] = key
+        heapq.heappush(self._heap, (*key, user_id))
+        # Устаревших записей стало слишком много - пересобираем кучу
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._heap = [(*current, uid) for uid, current in self._current.items()]
+            heapq.heapify(self._heap)
+
+    # Убрать пользователя; старая запись останется в куче и будет пропущена при чтении
+    def discard(self, user_id):
+        self._current.pop(str(user_id), None)
+
+    # Самый давний ожидающий user_id (без удаления) или None
+    def peek(self):
+        heap = self._heap
+        while heap:
+            timestamp, seq, user_id = heap[0]
+            if self._current.get(user_id) == (timestamp, seq):
+                return user_id
+            heapq.heappop(heap)
+        return None
+
+    # Учёт отправки: ждёт ответа, пока в последней отправке нет admin_response
+    def record_submission(self, user_id, entry):
+        if entry.get('admin_response'):
+            self.discard(user_id)
+        else:
+            self.push(user_id, entry['timestamp'])
+
+    def load(self, submissions):
+        for user_id, entry in submissions:
+            self.record_submission(user_id, entry)
+        return self
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from aiogram.fsm.state import StatesGroup, State
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+# Тест из questions.json; остальные тесты лежат в каталоге quizzes/
+DEFAULT_QUIZ_ID = "default"
+
+
+# Состояния теста: номер текущего вопроса хранится в данных FSM (question_num)
+class Test(StatesGroup):
+    Answering = State()
+    # Ожидание подтверждения ответа Да/Нет
+    Confirming = State()
+
+
+# Готовое к отправке представление вопроса (общий объект - не изменять)
+QuestionRender = namedtuple('QuestionRender', ['text', 'keyboard', 'image'])
+
+
+# Клавиатура вопроса: варианты ответа (для choice) и кнопка отмены
+def build_question_keyboard(question_num, question):
+    keyboard = []
+    if question['type'] == 'choice':
+        for i, option in enumerate(question.get('options', [])):
+            keyboard.append([InlineKeyboardButton(
+                text=option,
+                callback_data=f"answer_{question_num}_{i}"
+            )])
+    keyboard.append([InlineKeyboardButton(
+        text="❌ Отмена",
+        callback_data="cancel_test"
+    )])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+# Версия набора вопросов - хэш содержимого, одинаковая на всех воркерах
+def questions_version(questions):
+    return hashlib.sha1(
+        json.dumps(questions, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    ).hexdigest()[:12]
+
+
+# Тест, полностью описанный списком вопросов из questions.json
+class Quiz:
+    """Все переходы и поиски - по заранее построенным таблицам, O(1) на обновление"""
+
+    def __init__(self, questions, title=None):
+        self.title = title
+        self.questions = tuple(questions)
+        self.total = len(self.questions)
+        # Таблицы индексируются номером вопроса (с 1), элемент 0 не используется
+        self._questions = (None,) + self.questions
+        self._next = tuple(range(1, self.total + 2))
+        self._answer_keys = (None,) + tuple(str(q['id']) for q in self.questions)
+        self._options = (None,) + tuple(tuple(q.get('options', [])) for q in self.questions)
+        self.question_ids = self._answer_keys[1:]
+        # {id вопроса: [варианты]} для вопросов с выбором
+        self.choice_questions = {
+            q['id']: list(q.get('options', [])) for q in self.questions if q['type'] == 'choice'
+        }
+        # Текст, клавиатура и картинка вопроса строятся при первом показе и дальше переиспользуются:
+        # клавиатуры - модели pydantic, и сборка всех сразу заметно удлиняет старт на больших тестах
+        self._renders = [None] * (self.total + 1)
+
+    def _compile(self, question_num, question):
+        image = question.get('image', '')
+        return QuestionRender(
+            text=f"**Вопрос {question_num} из {self.total}**\n\n{question['text']}",
+            keyboard=build_question_keyboard(question_num, question),
+            image=image if image and os.path.isfile(image) else None
+        )
+
+    def __bool__(self):
+        return self.total > 0
+
+    def has(self, question_num):
+        return 0 < question_num <= self.total
+
+    def question(self, question_num):
+        return self._questions[question_num]
+
+    def render(self, question_num):
+        render = self._renders[question_num]
+        if render is None:
+            render = self._renders[question_num] = self._compile(question_num, self._questions[question_num])
+        return render
+
+    # Номер следующего вопроса (total + 1 означает конец теста)
+    def next(self, question_num):
+        return self._next[question_num]
+
+    def is_finished(self, question_num):
+        return question_num > self.total
+
+    # Ключ ответа в test_answers (id вопроса)
+    def answer_key(self, question_num):
+        return self._answer_keys[question_num]
+
+    # Текст варианта ответа или None, если такого варианта нет
+    def option(self, question_num, option_num):
+        options = self._options[question_num] if self.has(question_num) else ()
+        return options[option_num] if 0 <= option_num < len(options) else None
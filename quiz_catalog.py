@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+from quiz import Quiz, questions_version
+
+logger = logging.getLogger(__name__)
+
+# id теста - имя файла без .json; допустимые символы те же, что у параметра deep link /start
+QUIZ_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+# Сколько версий одного теста держать для уже начатых сессий
+MAX_VERSIONS = 3
+
+
+class CatalogEntry:
+    def __init__(self, mtime):
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+        self.quiz = None
+        self.version = None
+        # версия -> Quiz: сессия проходит тест в той версии, с которой начала
+        self.quizzes = OrderedDict()
+
+    @property
+    def size(self):
+        return sum(quiz.total for quiz in self.quizzes.values())
+
+
+# Каталог тестов quizzes/<quiz_id>.json: файл читается при первом обращении и держится в LRU
+class QuizCatalog:
+    """Лимиты кэша - число загруженных тестов и суммарное число вопросов в них"""
+
+    def __init__(self, directory="quizzes", max_loaded=16, max_questions=5000, check_interval=5):
+        self.directory = directory
+        self.max_loaded = max_loaded
+        self.max_questions = max_questions
+        # Не чаще этого проверяем mtime файла и список каталога
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.loaded_questions = 0
+        self._ids = []
+        self._listed_at = None
+        # Вызываются с (quiz_id, Quiz) при загрузке теста и каждой смене его версии
+        self.listeners = []
+
+    def _path(self, quiz_id):
+        return os.path.join(self.directory, f"{quiz_id}.json")
+
+    # id всех тестов каталога (по списку файлов, без чтения содержимого)
+    def list_ids(self):
+        now = time.monotonic()
+        if self._listed_at is None or now - self._listed_at >= self.check_interval:
+            self._listed_at = now
+            try:
+                names = os.listdir(self.directory)
+            except OSError:
+                names = []
+            self._ids = sorted(
+                name[:-5] for name in names if name.endswith('.json') and QUIZ_ID_PATTERN.match(name[:-5])
+            )
+        return self._ids
+
+    def exists(self, quiz_id):
+        return bool(quiz_id) and QUIZ_ID_PATTERN.match(quiz_id) is not None and quiz_id in self.list_ids()
+
+    # Название для меню: из уже загруженного файла, иначе сам id (файл ради меню не читаем)
+    def title(self, quiz_id):
+        entry = self.entries.get(quiz_id)
+        return entry.quiz.title if entry else quiz_id
+
+    def _read(self, quiz_id):
+        path = self._path(quiz_id)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return os.stat(path).st_mtime_ns, data.get('title') or quiz_id, data.get('questions', [])
+
+    # Актуальный тест: (Quiz, версия) или (None, None), если файла нет или он битый
+    async def get(self, quiz_id):
+        entry = await self._load(quiz_id)
+        return (entry.quiz, entry.version) if entry else (None, None)
+
+    # Тест для сессии: её версия, если она ещё в кэше, иначе актуальная
+    async def get_quiz(self, quiz_id, version=None):
+        entry = await self._load(quiz_id)
+        if entry is None:
+            return None
+        return entry.quizzes.get(version, entry.quiz)
+
+    # id вопросов текущей версии теста, затем вопросов из удерживаемых прежних версий
+    def known_question_ids(self, quiz_id):
+        entry = self.entries.get(quiz_id)
+        if entry is None:
+            return []
+        question_ids = list(entry.quiz.question_ids)
+        for quiz in reversed(entry.quizzes.values()):
+            question_ids.extend(q_id for q_id in quiz.question_ids if q_id not in question_ids)
+        return question_ids
+
+    async def _load(self, quiz_id):
+        if not self.exists(quiz_id):
+            return None
+
+        entry = self.entries.get(quiz_id)
+        now = time.monotonic()
+        if entry is not None:
+            self.entries.move_to_end(quiz_id)
+            if now - entry.checked_at < self.check_interval:
+                return entry
+            entry.checked_at = now
+            try:
+                mtime = await asyncio.to_thread(lambda: os.stat(self._path(quiz_id)).st_mtime_ns)
+            except OSError:
+                return entry
+            if mtime == entry.mtime:
+                return entry
+
+        try:
+            mtime, title, questions = await asyncio.to_thread(self._read, quiz_id)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Не удалось прочитать тест {quiz_id}: {e}")
+            return entry
+
+        if entry is None:
+            entry = self.entries[quiz_id] = CatalogEntry(mtime)
+        entry.mtime = mtime
+        previous = entry.version
+        self._publish(entry, Quiz(questions, title=title), questions_version(questions))
+        if entry.version != previous:
+            for listener in self.listeners:
+                listener(quiz_id, entry.quiz)
+        self._evict(keep=quiz_id)
+        logger.info(f"Тест {quiz_id} загружен: версия {entry.version}, вопросов {entry.quiz.total}")
+        return entry
+
+    def _publish(self, entry, quiz, version):
+        self.loaded_questions -= entry.size
+        entry.quizzes[version] = entry.quizzes.get(version) or quiz
+        entry.quizzes.move_to_end(version)
+        while len(entry.quizzes) > MAX_VERSIONS:
+            entry.quizzes.popitem(last=False)
+        entry.quiz, entry.version = entry.quizzes[version], version
+        self.loaded_questions += entry.size
+
+    # Выгружаем давно не использованные тесты, пока не уложимся в лимиты
+    def _evict(self, keep):
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_loaded or self.loaded_questions > self.max_questions
+        ):
+            quiz_id = next(iter(self.entries))
+            if quiz_id == keep:
+                self.entries.move_to_end(quiz_id)
+                continue
+            self.loaded_questions -= self.entries.pop(quiz_id).size
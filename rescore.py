@@ -0,0 +1,271 @@
+"""Пересчёт автоматических оценок всех сохранённых отправок и аналитика по вопросам.
+
+Нужен после изменения ключей в scoring/: отправки читаются пачками, пачки оцениваются
+в пуле процессов, оценки записываются обратно по мере готовности. После каждой записанной
+пачки обновляется файл чекпоинта, так что прерванный запуск продолжается с того же места.
+
+Запуск:
+    python rescore.py                          # хранилище из STORAGE_BACKEND / SQLITE_PATH
+    python rescore.py --quiz default --workers 4
+    python rescore.py --restart                # игнорировать чекпоинт и начать сначала
+
+Файловое хранилище (all_answers.jsonl) пересчитывайте при остановленном боте: журнал
+пишет только один процесс. SQLite можно пересчитывать на работающем боте.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from log_setup import setup_logging
+from scoring import ScoringEngine
+from storage import create_store, entry_quiz_id
+
+logger = logging.getLogger("rescore")
+
+# Ключ оценки в рабочем процессе (создаётся инициализатором пула)
+_engine = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default=os.getenv('STORAGE_BACKEND', 'file'), choices=('file', 'sqlite'))
+    parser.add_argument('--sqlite-path', default=os.getenv('SQLITE_PATH', 'submissions.db'))
+    parser.add_argument('--scoring-dir', default=os.getenv('SCORING_DIR', 'scoring'))
+    parser.add_argument('--quiz', help="пересчитать только этот тест")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="отправок в пачке")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="процессов (0 - в текущем)")
+    parser.add_argument('--checkpoint', default='rescore.checkpoint.json')
+    parser.add_argument('--report', default='rescore_report.json', help="куда записать аналитику")
+    parser.add_argument('--restart', action='store_true', help="начать сначала, даже если есть чекпоинт")
+    return parser.parse_args()
+
+
+def _init_worker(directory):
+    global _engine
+    _engine = ScoringEngine(directory)
+
+
+# Оценка пачки [(quiz_id, answers, прежний итог), ...] -> (оценки, частичная аналитика)
+def score_chunk(items):
+    scores = []
+    analytics = {}
+    for quiz_id, answers, old_total in items:
+        score = _engine.scorer(quiz_id).score(answers)
+        scores.append(score)
+
+        stats = analytics.get(quiz_id)
+        if stats is None:
+            stats = analytics[quiz_id] = {"count": 0, "sum": 0.0, "sumsq": 0.0, "review": 0, "changed": 0, "questions": {}}
+        total = score['total']
+        stats["count"] += 1
+        stats["sum"] += total
+        stats["sumsq"] += total * total
+        stats["review"] += score['review']
+        stats["changed"] += old_total is None or abs(old_total - total) >= 0.001
+        for q_id, value in score['questions'].items():
+            # [сумма, сумма квадратов, сумма произведений с итогом, полных баллов, нулевых]
+            sums = stats["questions"].setdefault(q_id, [0.0, 0.0, 0.0, 0, 0])
+            sums[0] += value
+            sums[1] += value * value
+            sums[2] += value * total
+            sums[3] += value >= 1.0
+            sums[4] += value <= 0.0
+    return scores, analytics
+
+
+# Сложение частичной аналитики пачки с накопленной
+def merge_analytics(into, part):
+    for quiz_id, stats in part.items():
+        target = into.get(quiz_id)
+        if target is None:
+            into[quiz_id] = stats
+            continue
+        for field in ("count", "sum", "sumsq", "review", "changed"):
+            target[field] += stats[field]
+        for q_id, sums in stats["questions"].items():
+            current = target["questions"].setdefault(q_id, [0.0, 0.0, 0.0, 0, 0])
+            for i, value in enumerate(sums):
+                current[i] += value
+    return into
+
+
+def _std(count, total, sumsq):
+    return math.sqrt(max(sumsq / count - (total / count) ** 2, 0.0))
+
+
+# Итоговые показатели: средний балл и разброс, доли полных и нулевых баллов,
+# дискриминативность вопроса - корреляция его балла с итогом теста
+def summarize(analytics):
+    report = {}
+    for quiz_id, stats in analytics.items():
+        n = stats["count"]
+        total_std = _std(n, stats["sum"], stats["sumsq"])
+        questions = {}
+        for q_id, (q_sum, q_sumsq, cross, full, zero) in stats["questions"].items():
+            q_std = _std(n, q_sum, q_sumsq)
+            covariance = cross / n - (q_sum / n) * (stats["sum"] / n)
+            questions[q_id] = {
+                "mean": round(q_sum / n, 3),
+                "std": round(q_std, 3),
+                "full_share": round(full / n, 3),
+                "zero_share": round(zero / n, 3),
+                "discrimination": round(covariance / (q_std * total_std), 3) if q_std and total_std else None
+            }
+        report[quiz_id] = {
+            "submissions": n,
+            "mean": round(stats["sum"] / n, 3),
+            "std": round(total_std, 3),
+            "review": stats["review"],
+            "changed": stats["changed"],
+            "questions": questions
+        }
+    return report
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Версии всех ключей: чекпоинт, сделанный с другими ключами, не продолжаем
+def key_versions(engine):
+    try:
+        names = os.listdir(engine.directory)
+    except OSError:
+        names = []
+    versions = {}
+    for name in sorted(names):
+        if name.endswith('.json'):
+            scorer = engine.scorer(name[:-5])
+            if scorer is not None:
+                versions[name[:-5]] = scorer.version
+    return versions
+
+
+def load_checkpoint(args, keys):
+    if args.restart or not os.path.isfile(args.checkpoint):
+        return None
+    with open(args.checkpoint, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if (checkpoint.get('backend'), checkpoint.get('quiz'), checkpoint.get('keys')) != (args.backend, args.quiz, keys):
+        logger.warning("Чекпоинт сделан для другого хранилища, теста или ключей - пересчёт начнётся сначала")
+        return None
+    logger.info(f"Продолжаем с чекпоинта: обработано {checkpoint['processed']} отправок")
+    return checkpoint
+
+
+async def rescore(args):
+    engine = ScoringEngine(args.scoring_dir)
+    keys = key_versions(engine)
+    if args.quiz:
+        keys = {quiz_id: version for quiz_id, version in keys.items() if quiz_id == args.quiz}
+    if not keys:
+        logger.error(f"Нет ключей оценки в {args.scoring_dir}")
+        return None
+
+    checkpoint = load_checkpoint(args, keys) or {
+        "backend": args.backend, "quiz": args.quiz, "keys": keys, "cursor": None, "processed": 0, "analytics": {}
+    }
+
+    store = await create_store(args.backend, sqlite_path=args.sqlite_path).open()
+    loop = asyncio.get_running_loop()
+    if args.workers:
+        pool = ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(args.scoring_dir,))
+    else:
+        pool = None
+        _init_worker(args.scoring_dir)
+
+    chunks = store.iter_chunks(args.chunk_size, after=checkpoint["cursor"])
+    # Пачки в работе, в порядке чтения: записываем строго по порядку, иначе курсор чекпоинта соврёт
+    in_flight = deque()
+    started = time.monotonic()
+    resumed_from = checkpoint["processed"]
+
+    async def write_oldest():
+        cursor, refs, future = in_flight.popleft()
+        scores, analytics = await future
+        if refs:
+            await store.set_scores(list(zip(refs, scores)))
+        checkpoint["cursor"] = cursor
+        checkpoint["processed"] += len(refs)
+        merge_analytics(checkpoint["analytics"], analytics)
+        await asyncio.to_thread(_write_json, args.checkpoint, checkpoint)
+        done = checkpoint["processed"] - resumed_from
+        logger.info(f"Пересчитано {checkpoint['processed']} отправок ({done / (time.monotonic() - started):.0f}/с)")
+
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            cursor, rows = chunk
+            refs, items = [], []
+            for ref, user_id, entry in rows:
+                quiz_id = entry_quiz_id(entry)
+                if quiz_id not in keys:
+                    continue
+                refs.append(ref)
+                old_score = entry.get('score')
+                items.append((quiz_id, entry['answers'], old_score['total'] if old_score else None))
+
+            future = loop.run_in_executor(pool, score_chunk, items) if pool else loop.create_future()
+            if pool is None:
+                future.set_result(score_chunk(items))
+            in_flight.append((cursor, refs, future))
+            # Не читаем хранилище сильно впереди пула: в памяти не больше двух пачек на процесс
+            while len(in_flight) >= max(args.workers, 1) * 2:
+                await write_oldest()
+        while in_flight:
+            await write_oldest()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        # Журнал после пересчёта почти целиком из строк-операций - пересобираем
+        await store.maintenance()
+        await store.close()
+
+    report = summarize(checkpoint["analytics"])
+    _write_json(args.report, {"keys": keys, "quizzes": report})
+    if os.path.isfile(args.checkpoint):
+        os.remove(args.checkpoint)
+    return report
+
+
+def print_report(report):
+    for quiz_id, stats in report.items():
+        print(f"\n{quiz_id}: {stats['submissions']} отправок, средний балл {stats['mean'] * 100:.0f}% "
+              f"(σ {stats['std'] * 100:.0f}), на проверку {stats['review']}, изменилось {stats['changed']}")
+        print(f"  {'вопрос':<8}{'средний':>9}{'σ':>7}{'100%':>7}{'0%':>7}{'дискр.':>8}")
+        for q_id, q in stats['questions'].items():
+            discrimination = f"{q['discrimination']:.2f}" if q['discrimination'] is not None else "—"
+            print(f"  {q_id:<8}{q['mean'] * 100:>8.0f}%{q['std'] * 100:>7.0f}"
+                  f"{q['full_share'] * 100:>6.0f}%{q['zero_share'] * 100:>6.0f}%{discrimination:>8}")
+
+
+def main():
+    load_dotenv()
+    setup_logging(os.getenv('LOG_LEVEL', 'INFO'), json_format=False)
+    args = parse_args()
+    try:
+        report = asyncio.run(rescore(args))
+    except KeyboardInterrupt:
+        logger.warning(f"Пересчёт прерван; повторный запуск продолжит с {args.checkpoint}")
+        return
+    if report is not None:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
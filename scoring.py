@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+
+STOP_WORDS = frozenset(
+    "и в во на не что это как для по с со а но или то же ли бы от до из за к ко о об при про так "
+    "его её их он она они оно мы вы я ты есть быть был была было были который которая которые "
+    "the a an of to in and or is are for on with as by it this that".split()
+)
+
+# Окончания для грубого стемминга русского текста: длинные проверяются первыми
+_ENDINGS = tuple(sorted((
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ость", "ости", "ение", "ения", "ании", "ание",
+    "ия", "ие", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ов", "ев", "ах", "ях", "ам", "ям", "ом",
+    "ем", "ую", "юю", "ет", "ют", "ит", "ат", "ят", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь"
+), key=len, reverse=True))
+
+
+def stem(token):
+    for ending in _ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_RE.findall(str(text).lower()) if token not in STOP_WORDS and len(token) > 1]
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+
+# TF-IDF индекс эталонных ответов: строится один раз при загрузке ключа
+class ReferenceIndex:
+    """IDF считается по всем эталонам теста, так что общие слова весят меньше специфичных для вопроса"""
+
+    def __init__(self, references):
+        # references: {q_id: [эталонный текст, ...]}
+        tokenized = {q_id: [tokenize(text) for text in texts] for q_id, texts in references.items()}
+        documents = [tokens for texts in tokenized.values() for tokens in texts]
+        self.documents = len(documents)
+        df = Counter(term for tokens in documents for term in set(tokens))
+        self.idf = {term: math.log((self.documents + 1) / (count + 1)) + 1 for term, count in df.items()}
+        # Вес слова, которого нет ни в одном эталоне: оно только "разбавляет" ответ
+        self.unknown_idf = math.log(self.documents + 1) + 1
+        self.vectors = {
+            q_id: [self.vectorize(tokens) for tokens in texts] for q_id, texts in tokenized.items()
+        }
+
+    def vectorize(self, tokens):
+        counts = Counter(tokens)
+        return _normalize({
+            term: (1 + math.log(count)) * self.idf.get(term, self.unknown_idf) for term, count in counts.items()
+        })
+
+    # Косинусная близость ответа к ближайшему эталону вопроса (0..1)
+    def similarity(self, q_id, tokens):
+        answer = self.vectorize(tokens)
+        if not answer:
+            return 0.0
+        return max(
+            (sum(weight * reference.get(term, 0.0) for term, weight in answer.items())
+             for reference in self.vectors.get(q_id, ())),
+            default=0.0
+        )
+
+
+# Оценка отправок одного теста по ключу scoring/<quiz_id>.json
+class Scorer:
+    """choice - совпадение с правильным вариантом, text - близость к эталонам, итог - взвешенное среднее"""
+
+    def __init__(self, key, version=None):
+        self.version = version
+        self.questions = {str(q_id): spec for q_id, spec in key.get('questions', {}).items()}
+        # Балл текстового ответа = близость / full_credit (не больше 1)
+        self.full_credit = key.get('full_credit', 0.5)
+        # Итог внутри этого диапазона - пограничный случай, который стоит проверить админу
+        self.review_band = tuple(key.get('review_band', (0.4, 0.7)))
+        # Ответ короче min_tokens значимых слов получает пропорционально меньший балл:
+        # иначе одно совпавшее слово даёт высокую косинусную близость
+        self.min_tokens = key.get('min_tokens', 5)
+        self.index = ReferenceIndex({
+            q_id: spec['references'] for q_id, spec in self.questions.items() if spec.get('references')
+        })
+
+    def score_question(self, q_id, answer):
+        spec = self.questions[q_id]
+        if 'answer' in spec:
+            correct = spec['answer']
+            correct = correct if isinstance(correct, list) else [correct]
+            return 1.0 if answer in correct else 0.0
+        tokens = tokenize(answer) if answer is not None else []
+        if not tokens:
+            return 0.0
+        coverage = min(len(tokens) / self.min_tokens, 1.0)
+        return min(self.index.similarity(q_id, tokens) / self.full_credit, 1.0) * coverage
+
+    def score(self, answers):
+        scores = {}
+        weighted = 0.0
+        weights = 0.0
+        for q_id, spec in self.questions.items():
+            value = self.score_question(q_id, answers.get(q_id))
+            scores[q_id] = round(value, 3)
+            weight = spec.get('weight', 1)
+            weighted += value * weight
+            weights += weight
+        total = weighted / weights if weights else 0.0
+        low, high = self.review_band
+        return {
+            "total": round(total, 3),
+            "questions": scores,
+            "review": low <= total < high,
+            "key": self.version
+        }
+
+
+# Ключи всех тестов: файл читается при первом обращении и перечитывается при изменении
+class ScoringEngine:
+    def __init__(self, directory="scoring"):
+        self.directory = directory
+        # quiz_id -> (mtime_ns, Scorer или None)
+        self._scorers = {}
+        self._lock = threading.Lock()
+
+    def _path(self, quiz_id):
+        return os.path.join(self.directory, f"{quiz_id}.json")
+
+    # Scorer для теста или None, если ключа нет. Синхронный - вызывать из рабочего потока
+    def scorer(self, quiz_id):
+        path = self._path(quiz_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            cached = self._scorers.get(quiz_id)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            scorer = None
+            if mtime is not None:
+                try:
+                    with open(path, 'rb') as f:
+                        raw = f.read()
+                    scorer = Scorer(json.loads(raw), version=hashlib.sha1(raw).hexdigest()[:12])
+                    logger.info(f"Ключ оценки {quiz_id} загружен: версия {scorer.version}")
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    logger.error(f"Ошибка чтения ключа оценки {path}: {e}")
+            self._scorers[quiz_id] = (mtime, scorer)
+            return scorer
+
+    # Оценка записи на месте (entry['score']); записи теста без ключа остаются без оценки
+    def score_entry(self, quiz_id, entry):
+        scorer = self.scorer(quiz_id)
+        entry['score'] = scorer.score(entry['answers']) if scorer else None
+        return entry['score']
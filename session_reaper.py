@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+
+from metrics import fsm_reminders_total, fsm_sessions_expired_total
+
+logger = logging.getLogger(__name__)
+
+# Напоминаем только о незавершённом тесте (сессии админа истекают молча)
+REMIND_STATE_PREFIX = "Test:"
+
+
+# Фоновое удаление неактивных сессий FSM пачками и напоминания перед удалением
+class SessionReaper:
+    """storage должен уметь cleanup_expired(batch_size) и idle_sessions(idle_since, after, limit)"""
+
+    def __init__(self, storage, ttl, remind=None, remind_before=0, interval=60, batch_size=500):
+        self.storage = storage
+        self.ttl = ttl
+        # remind(chat_id, data) - корутина, отправляющая напоминание
+        self.remind = remind if remind_before and remind_before < ttl else None
+        self.remind_before = remind_before
+        self.interval = interval
+        self.batch_size = batch_size
+        # Время последнего обращения к последней сессии, о которой уже напомнили.
+        # После перезапуска не напоминаем тем, кто пересёк порог раньше: им могли напомнить до остановки
+        self.remind_cursor = time.time() - (ttl - remind_before)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap_once()
+            except Exception as e:
+                logger.error(f"Ошибка очистки сессий теста: {e}")
+
+    async def reap_once(self):
+        reminded = await self._send_reminders() if self.remind else 0
+
+        removed = 0
+        while True:
+            batch = await self.storage.cleanup_expired(self.batch_size)
+            removed += batch
+            if batch < self.batch_size:
+                break
+            # Между пачками отдаём цикл событий обработчикам
+            await asyncio.sleep(0)
+
+        if removed:
+            fsm_sessions_expired_total.inc(amount=removed)
+            logger.info(f"Удалено истёкших сессий теста: {removed}")
+        return removed, reminded
+
+    async def _send_reminders(self):
+        reminded = 0
+        idle_since = time.time() - (self.ttl - self.remind_before)
+        while True:
+            sessions = await self.storage.idle_sessions(idle_since, self.remind_cursor, self.batch_size)
+            for chat_id, state, data, touched_at in sessions:
+                self.remind_cursor = touched_at
+                if not (state or "").startswith(REMIND_STATE_PREFIX):
+                    continue
+                try:
+                    await self.remind(chat_id, data)
+                    reminded += 1
+                except Exception as e:
+                    logger.warning(f"Не удалось напомнить о тесте в чат {chat_id}: {e}")
+            if len(sessions) < self.batch_size:
+                break
+        if reminded:
+            fsm_reminders_total.inc(amount=reminded)
+        return reminded
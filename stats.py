@@ -0,0 +1,126 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from quiz import DEFAULT_QUIZ_ID
+from storage import needs_review
+
+
+# Накопительная статистика по отправкам для админ-панели
+class StatsAggregator:
+    """Счётчики обновляются на каждой отправке и ответе админа, чтение - O(1)"""
+
+    def __init__(self, choice_questions=None):
+        # {q_id: [варианты]} - только вопросы типа choice
+        self.choice_questions = {str(q_id): options for q_id, options in (choice_questions or {}).items()}
+        self.submissions = 0
+        # user_id -> есть ли ответ админа на последнюю отправку
+        self.users = {}
+        self.answered = 0
+        self.choices = {q_id: Counter() for q_id in self.choice_questions}
+        self.by_hour = Counter()
+        self.by_day = Counter()
+        self.by_quiz = Counter()
+        # Автоматическая оценка: сумма итоговых баллов, средние по вопросам основного теста
+        self.scored = 0
+        self.score_total = 0.0
+        self.question_scores = {}
+        # Пользователи, чья последняя отправка пограничная и ещё без ответа админа
+        self.review_users = set()
+
+    # Новый набор вопросов с выбором: счётчики уже известных вопросов сохраняются
+    def set_choice_questions(self, choice_questions):
+        self.choice_questions = {str(q_id): options for q_id, options in choice_questions.items()}
+        for q_id in self.choice_questions:
+            self.choices.setdefault(q_id, Counter())
+
+    @property
+    def total_users(self):
+        return len(self.users)
+
+    @property
+    def pending(self):
+        return self.total_users - self.answered
+
+    # Начальное заполнение из хранилища (итератор пар user_id, entry)
+    def load(self, submissions):
+        for user_id, entry in submissions:
+            self.record_submission(user_id, entry)
+        return self
+
+    # Учёт новой отправки
+    def record_submission(self, user_id, entry):
+        user_id = str(user_id)
+        self.submissions += 1
+
+        answered = bool(entry.get('admin_response'))
+        previous = self.users.get(user_id)
+        if previous:
+            self.answered -= 1
+        if answered:
+            self.answered += 1
+        self.users[user_id] = answered
+
+        # Распределение по вариантам - только для основного теста, у других свои id вопросов
+        quiz_id = entry.get('quiz_id') or DEFAULT_QUIZ_ID
+        self.by_quiz[quiz_id] += 1
+        if quiz_id == DEFAULT_QUIZ_ID:
+            for q_id, counter in self.choices.items():
+                answer = entry['answers'].get(q_id)
+                if answer is not None:
+                    counter[answer] += 1
+
+        self.review_users.discard(user_id)
+        if needs_review(entry):
+            self.review_users.add(user_id)
+        score = entry.get('score')
+        if score:
+            self.scored += 1
+            self.score_total += score['total']
+            if quiz_id == DEFAULT_QUIZ_ID:
+                for q_id, value in score['questions'].items():
+                    totals = self.question_scores.setdefault(q_id, [0.0, 0])
+                    totals[0] += value
+                    totals[1] += 1
+
+        timestamp = entry['timestamp']
+        self.by_day[timestamp[:10]] += 1
+        self.by_hour[timestamp[:13]] += 1
+
+    # Учёт ответа админа пользователю
+    def record_response(self, user_id):
+        user_id = str(user_id)
+        self.review_users.discard(user_id)
+        if user_id in self.users and not self.users[user_id]:
+            self.users[user_id] = True
+            self.answered += 1
+
+    @property
+    def average_score(self):
+        return self.score_total / self.scored if self.scored else None
+
+    # Средний балл по вопросам основного теста: [(q_id, балл), ...]
+    def question_averages(self):
+        return [(q_id, total / count) for q_id, (total, count) in self.question_scores.items()]
+
+    # Распределение ответов по вариантам: {q_id: [(вариант, количество), ...]}
+    def choice_distribution(self):
+        return {
+            q_id: [(option, self.choices[q_id][option]) for option in options]
+            for q_id, options in self.choice_questions.items()
+        }
+
+    # Завершения за последние N дней, от старых к новым
+    def daily(self, days=14, now=None):
+        today = (now or datetime.now()).date()
+        return [
+            (day, self.by_day[day])
+            for day in ((today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days - 1, -1, -1))
+        ]
+
+    # Завершения за последние N часов, от старых к новым
+    def hourly(self, hours=24, now=None):
+        current = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+        return [
+            (hour, self.by_hour[hour])
+            for hour in ((current - timedelta(hours=i)).strftime("%Y-%m-%d %H") for i in range(hours - 1, -1, -1))
+        ]
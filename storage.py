@@ -0,0 +1,822 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+from metrics import storage_write_seconds
+from quiz import DEFAULT_QUIZ_ID
+
+logger = logging.getLogger(__name__)
+
+
+# Новая запись об отправке теста; quiz_version - снимок вопросов, на котором проходили тест
+def make_entry(username, answers, quiz_id=DEFAULT_QUIZ_ID, quiz_version=None):
+    entry = {
+        "username": username,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "quiz_id": quiz_id,
+        "answers": answers,
+        "admin_response": None
+    }
+    if quiz_version:
+        entry["quiz_version"] = quiz_version
+    return entry
+
+
+# Пограничная автоматическая оценка без ответа админа - такие отправки стоит проверить вручную
+def needs_review(entry):
+    score = entry.get('score')
+    return bool(score and score.get('review')) and not entry.get('admin_response')
+
+
+# Фильтры браузера ответов, в которые попадает последняя отправка пользователя
+def entry_statuses(entry):
+    statuses = ("answered",) if entry.get('admin_response') else ("pending",)
+    return statuses + ("review",) if needs_review(entry) else statuses
+
+
+# Тест, к которому относится отправка (в старых записях поля нет - это основной тест)
+def entry_quiz_id(entry):
+    return entry.get('quiz_id') or DEFAULT_QUIZ_ID
+
+
+# Append-only журнал ответов (JSON Lines) с индексом по пользователям в памяти
+class AnswerLog:
+    """Каждая отправка теста - одна строка в файле, запись стоит O(1)"""
+
+    def __init__(self, path="all_answers.jsonl", legacy_path="all_answers.json", compact_ratio=0.5):
+        self.path = path
+        self.legacy_path = legacy_path
+        # Доля "мёртвых" строк, после которой файл стоит пересобрать
+        self.compact_ratio = compact_ratio
+        self.index = {}
+        # Порядок появления пользователей и поиск по username - для постраничного просмотра
+        self.user_ids = []
+        self.usernames = {}
+        self._init_statuses()
+        self.records = 0
+        self.dead = 0
+        self._lock = threading.Lock()
+
+    # Индекс страниц с фильтром: отсортированные позиции пользователей (в user_ids) по статусу
+    # последней отправки, так что страница - срез списка без обхода всех пользователей
+    def _init_statuses(self):
+        self.positions = {}
+        self.user_statuses = {}
+        self.by_status = {"pending": [], "answered": [], "review": []}
+
+    # Перенос пользователя между списками статусов после изменения его последней отправки
+    def _classify(self, user_id):
+        new = entry_statuses(self.index[user_id][-1])
+        old = self.user_statuses.get(user_id, ())
+        if new == old:
+            return
+        position = self.positions[user_id]
+        for status in old:
+            if status not in new:
+                positions = self.by_status[status]
+                del positions[bisect_left(positions, position)]
+        for status in new:
+            if status not in old:
+                insort(self.by_status[status], position)
+        self.user_statuses[user_id] = new
+
+    # Загрузка журнала и построение индекса
+    def load(self):
+        with self._lock:
+            self.index = {}
+            self.user_ids = []
+            self.usernames = {}
+            self._init_statuses()
+            self.records = 0
+            self.dead = 0
+
+            if not os.path.isfile(self.path) and self.legacy_path and os.path.isfile(self.legacy_path):
+                self._migrate_legacy()
+
+            if not os.path.isfile(self.path):
+                return self
+
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                        if not self._apply(record):
+                            continue
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        # Оборванная запись (например, после падения процесса)
+                        self.dead += 1
+                        continue
+                    self.records += 1
+
+            # Статусы - один раз по итогу журнала, а не после каждой строки
+            for user_id in self.user_ids:
+                self._classify(user_id)
+
+            # Оборванная последняя строка не должна склеиться со следующей записью
+            with open(self.path, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+
+        logger.info(f"Журнал ответов загружен: {self.records} записей, {len(self.index)} пользователей")
+        return self
+
+    # Одноразовая миграция из старого all_answers.json
+    def _migrate_legacy(self):
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Не удалось прочитать {self.legacy_path}, миграция пропущена")
+            return
+
+        tmp_path = self.path + ".tmp"
+        count = 0
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for user_id, answers_list in data.items():
+                for entry in answers_list:
+                    f.write(self._dump(dict(entry, user_id=str(user_id))))
+                    count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        os.replace(self.legacy_path, self.legacy_path + ".migrated")
+        logger.info(f"Миграция {self.legacy_path} -> {self.path}: перенесено {count} записей")
+
+    @staticmethod
+    def _dump(record):
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def _apply(self, record):
+        user_id = str(record.pop('user_id'))
+        if record.get('op') == "response":
+            # Ответ админа дописан отдельной строкой; после компакции он окажется внутри записи
+            self.index[user_id][-1]['admin_response'] = record['response']
+            self.dead += 1
+            return False
+        if record.get('op') == "score":
+            # Пересчитанная оценка отправки с номером index среди отправок пользователя
+            self.index[user_id][record['index']]['score'] = record['score']
+            self.dead += 1
+            return False
+        self._index_entry(user_id, record)
+        return True
+
+    def _index_entry(self, user_id, entry):
+        entries = self.index.get(user_id)
+        if entries is None:
+            entries = self.index[user_id] = []
+            self.positions[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        entries.append(entry)
+        if entry.get('username'):
+            self.usernames[entry['username'].lower()] = user_id
+
+    # Добавление одной отправки в конец журнала
+    def append(self, user_id, username, answers):
+        entry = make_entry(username, answers)
+        self.append_many([(user_id, entry)])
+        return entry
+
+    # Добавление пачки готовых записей одной операцией записи
+    def append_many(self, items):
+        lines = "".join(self._dump(dict(entry, user_id=str(user_id))) for user_id, entry in items)
+
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+            for user_id, entry in items:
+                self._index_entry(str(user_id), entry)
+                self._classify(str(user_id))
+            self.records += len(items)
+
+    # Ответ админа на последнюю отправку: дописываем строку-операцию, файл не переписывается
+    def set_response(self, user_id, response):
+        user_id = str(user_id)
+        with self._lock:
+            entries = self.index.get(user_id)
+            if not entries:
+                return None
+            record = {
+                "op": "response",
+                "user_id": user_id,
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "response": response
+            }
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(self._dump(record))
+            entries[-1]['admin_response'] = response
+            self._classify(user_id)
+            self.dead += 1
+            return entries[-1]
+
+    # Пересчитанные оценки [((user_id, номер отправки), score), ...] - одна дозапись на пачку
+    def set_scores(self, items):
+        lines = "".join(
+            self._dump({"op": "score", "user_id": str(user_id), "index": index, "score": score})
+            for (user_id, index), score in items
+        )
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+            for (user_id, index), score in items:
+                self.index[str(user_id)][index]['score'] = score
+                self._classify(str(user_id))
+            self.dead += len(items)
+
+    # Все отправки пользователя
+    def get_user(self, user_id):
+        return self.index.get(str(user_id), [])
+
+    # Последняя отправка каждого пользователя (в порядке первого появления)
+    def latest(self):
+        return {user_id: entries[-1] for user_id, entries in self.index.items()}
+
+    def needs_compaction(self):
+        total = self.records + self.dead
+        return total > 0 and self.dead / total >= self.compact_ratio
+
+    # Пересборка файла из индекса: выкидываем битые и устаревшие строки
+    def compact(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            records = 0
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for user_id, entries in self.index.items():
+                    for entry in entries:
+                        f.write(self._dump(dict(entry, user_id=user_id)))
+                        records += 1
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            removed = self.dead
+            self.records = records
+            self.dead = 0
+        logger.info(f"Компакция журнала ответов: удалено {removed} строк, осталось {records}")
+
+    def compact_if_needed(self):
+        if self.needs_compaction():
+            self.compact()
+            return True
+        return False
+
+
+# Дозапись результатов в CSV (test_results.csv)
+class CsvResults:
+    def __init__(self, path="test_results.csv", question_ids=(1, 2, 3)):
+        self.path = path
+        self.question_ids = [str(q_id) for q_id in question_ids]
+        # Строки сессий, начатых на старой версии вопросов: версия -> CsvResults со своими колонками
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    # Смена колонок: старый файл откладывается, новый начнётся с нового заголовка
+    def set_question_ids(self, question_ids):
+        question_ids = [str(q_id) for q_id in question_ids]
+        with self._lock:
+            if question_ids == self.question_ids:
+                return
+            if os.path.isfile(self.path):
+                base, ext = os.path.splitext(self.path)
+                archived = f"{base}.{datetime.now().strftime('%Y%m%d%H%M%S')}{ext}"
+                os.replace(self.path, archived)
+                logger.info(f"Набор вопросов изменился, {self.path} перенесён в {archived}")
+            self.question_ids = question_ids
+
+    # Файл для строк старой версии: test_results.v<версия>.csv с колонками её вопросов
+    def _for_version(self, version, entry):
+        csv_results = self._versions.get(version)
+        if csv_results is None:
+            base, ext = os.path.splitext(self.path)
+            csv_results = self._versions[version] = CsvResults(f"{base}.v{version}{ext}", list(entry['answers']))
+        return csv_results
+
+    def append_many(self, items):
+        # Ответы, для которых нет колонок (сессия закрепила старую версию), не должны теряться
+        columns = set(self.question_ids)
+        current, stale = [], {}
+        for user_id, entry in items:
+            version = entry.get('quiz_version')
+            if version and not set(entry['answers']) <= columns:
+                stale.setdefault(version, []).append((user_id, entry))
+            else:
+                current.append((user_id, entry))
+        for version, version_items in stale.items():
+            self._for_version(version, version_items[0][1])._append(version_items)
+        if current:
+            self._append(current)
+
+    def _append(self, items):
+        with self._lock:
+            file_exists = os.path.isfile(self.path)
+            with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if not file_exists:
+                    writer.writerow(["user_id", "username", "timestamp"] + [f"Q{q_id}" for q_id in self.question_ids])
+                for user_id, entry in items:
+                    row = [user_id, entry['username'], entry['timestamp']]
+                    for q_id in self.question_ids:
+                        row.append(entry['answers'].get(q_id, ""))
+                    writer.writerow(row)
+
+
+# ========== ХРАНИЛИЩЕ ОТПРАВОК ==========
+
+class SubmissionStore(ABC):
+    """Интерфейс хранилища отправок теста. Все методы асинхронные и не блокируют event loop"""
+
+    async def open(self):
+        return self
+
+    async def close(self):
+        pass
+
+    # Сохранить одну отправку
+    async def add(self, user_id, username, answers):
+        entry = make_entry(username, answers)
+        await self.add_many([(user_id, entry)])
+        return entry
+
+    # Сохранить пачку отправок [(user_id, entry), ...]
+    @abstractmethod
+    async def add_many(self, items):
+        ...
+
+    # Все отправки пользователя, от старых к новым
+    @abstractmethod
+    async def get_user(self, user_id):
+        ...
+
+    # Последняя отправка каждого пользователя: {user_id: entry}
+    @abstractmethod
+    async def latest_by_user(self):
+        ...
+
+    # Счётчики для админ-статистики
+    @abstractmethod
+    async def stats(self):
+        ...
+
+    # Страница последних отправок пользователей: (всего, [(user_id, entry), ...], (первый ключ, последний ключ))
+    # status: None - все, "pending" - без ответа админа, "answered" - с ответом,
+    # "review" - без ответа админа и с пограничной автоматической оценкой; другой - ValueError.
+    # after/before - ключ соседней страницы: следующая/предыдущая страница без OFFSET;
+    # ключи страницы - None, если она пуста
+    @abstractmethod
+    async def latest_page(self, offset, limit, status=None, after=None, before=None):
+        ...
+
+    # Последняя отправка пользователя по user_id или username: (user_id, entry) или None
+    @abstractmethod
+    async def find_user(self, query):
+        ...
+
+    # Записать ответ админа на последнюю отправку пользователя: обновлённая entry или None
+    @abstractmethod
+    async def set_response(self, user_id, response):
+        ...
+
+    # Потоковый обход отправок (user_id, entry). Синхронный - вызывать из рабочего потока
+    # since/until - границы по timestamp ("YYYY-MM-DD HH:MM:SS"), until не включается
+    @abstractmethod
+    def iter_submissions(self, chunk_size=500, since=None, until=None):
+        ...
+
+    # Пачки отправок для пересчёта оценок: (курсор, [(ref, user_id, entry), ...]).
+    # Курсор - JSON-совместимая позиция последней отправки пачки; after продолжает обход с неё
+    @abstractmethod
+    def iter_chunks(self, chunk_size=500, after=None):
+        ...
+
+    # Записать пересчитанные оценки [(ref, score), ...]
+    @abstractmethod
+    async def set_scores(self, items):
+        ...
+
+    # Периодическое обслуживание (компакция, чекпоинт и т.п.)
+    async def maintenance(self):
+        pass
+
+    # Набор вопросов теста изменился (важно только для хранилищ с фиксированными колонками)
+    def set_question_ids(self, question_ids, quiz_id=DEFAULT_QUIZ_ID):
+        pass
+
+
+# Файловое хранилище: журнал all_answers.jsonl + test_results.csv
+class FileSubmissionStore(SubmissionStore):
+    def __init__(self, log_path="all_answers.jsonl", legacy_path="all_answers.json",
+                 csv_path="test_results.csv", question_ids=(1, 2, 3)):
+        self.log = AnswerLog(log_path, legacy_path)
+        self.csv = CsvResults(csv_path, question_ids)
+        # Остальные тесты - каждый в своём CSV рядом с основным: test_results.<quiz_id>.csv
+        self.quiz_csvs = {}
+        # Колонки остальных тестов - id вопросов из их определения (set_question_ids)
+        self.quiz_question_ids = {}
+
+    async def open(self):
+        await asyncio.to_thread(self.log.load)
+        return self
+
+    def _csv_for(self, quiz_id, entry):
+        if quiz_id == DEFAULT_QUIZ_ID:
+            return self.csv
+        csv_results = self.quiz_csvs.get(quiz_id)
+        if csv_results is None:
+            # Определение теста ещё не пришло - колонки по ответам первой отправки
+            question_ids = self.quiz_question_ids.get(quiz_id) or list(entry['answers'])
+            base, ext = os.path.splitext(self.csv.path)
+            csv_results = self.quiz_csvs[quiz_id] = CsvResults(f"{base}.{quiz_id}{ext}", question_ids)
+        return csv_results
+
+    # Сначала журнал - источник истины: если он не записался, пачку повторят целиком и CSV не задвоится.
+    # Ошибка CSV после записанного журнала не пробрасывается - иначе повтор задвоил бы журнал
+    async def add_many(self, items):
+        def write():
+            with storage_write_seconds.time("jsonl"):
+                self.log.append_many(items)
+            by_quiz = {}
+            for user_id, entry in items:
+                by_quiz.setdefault(entry_quiz_id(entry), []).append((user_id, entry))
+            with storage_write_seconds.time("csv"):
+                for quiz_id, quiz_items in by_quiz.items():
+                    try:
+                        self._csv_for(quiz_id, quiz_items[0][1]).append_many(quiz_items)
+                    except OSError as e:
+                        logger.error(f"Не удалось дописать CSV теста {quiz_id} ({len(quiz_items)} строк): {e}")
+        await asyncio.to_thread(write)
+
+    async def get_user(self, user_id):
+        return list(self.log.get_user(user_id))
+
+    async def latest_by_user(self):
+        return self.log.latest()
+
+    async def stats(self):
+        latest = self.log.latest()
+        answered = sum(1 for entry in latest.values() if entry.get('admin_response'))
+        return {"total_users": len(latest), "answered": answered, "submissions": self.log.records}
+
+    async def latest_page(self, offset, limit, status=None, after=None, before=None):
+        log = self.log
+        if status is None:
+            # Ключ - позиция в user_ids, так что список позиций - просто range
+            positions = range(len(log.user_ids))
+        elif status in log.by_status:
+            positions = log.by_status[status]
+        else:
+            raise ValueError(f"Неизвестный фильтр: {status}")
+
+        if after is not None:
+            offset = bisect_right(positions, after)
+        elif before is not None:
+            offset = max(bisect_left(positions, before) - limit, 0)
+            limit = min(limit, bisect_left(positions, before))
+        page = positions[offset:offset + limit]
+        user_ids = [log.user_ids[position] for position in page]
+        keys = (page[0], page[-1]) if user_ids else None
+        return len(positions), [(user_id, log.index[user_id][-1]) for user_id in user_ids], keys
+
+    async def find_user(self, query):
+        query = str(query).strip().lstrip('@')
+        user_id = query if query in self.log.index else self.log.usernames.get(query.lower())
+        if user_id is None:
+            return None
+        return user_id, self.log.index[user_id][-1]
+
+    async def set_response(self, user_id, response):
+        with storage_write_seconds.time("jsonl"):
+            entry = await asyncio.to_thread(self.log.set_response, user_id, response)
+        return dict(entry) if entry else None
+
+    def iter_submissions(self, chunk_size=500, since=None, until=None):
+        for user_id, entries in list(self.log.index.items()):
+            for entry in list(entries):
+                if since and entry['timestamp'] < since:
+                    continue
+                if until and entry['timestamp'] >= until:
+                    continue
+                yield user_id, entry
+
+    # Курсор - [позиция пользователя в порядке появления, номер его отправки]; ref - (user_id, номер)
+    def iter_chunks(self, chunk_size=500, after=None):
+        user_pos, skip = after if after else (0, -1)
+        chunk = []
+        for position in range(user_pos, len(self.log.user_ids)):
+            user_id = self.log.user_ids[position]
+            entries = self.log.index[user_id]
+            for index in range(skip + 1, len(entries)):
+                chunk.append(((user_id, index), user_id, entries[index]))
+                if len(chunk) >= chunk_size:
+                    yield [position, index], chunk
+                    chunk = []
+            skip = -1
+        if chunk:
+            yield [position, chunk[-1][0][1]], chunk
+
+    async def set_scores(self, items):
+        with storage_write_seconds.time("jsonl"):
+            await asyncio.to_thread(self.log.set_scores, items)
+
+    async def maintenance(self):
+        await asyncio.to_thread(self.log.compact_if_needed)
+
+    # Колонки меняются только с версией теста, а не по ответам отдельных отправок:
+    # сессия старой версии, завершённая после обновления, не переключает файл туда и обратно
+    def set_question_ids(self, question_ids, quiz_id=DEFAULT_QUIZ_ID):
+        if quiz_id == DEFAULT_QUIZ_ID:
+            self.csv.set_question_ids(question_ids)
+            return
+        self.quiz_question_ids[quiz_id] = list(question_ids)
+        csv_results = self.quiz_csvs.get(quiz_id)
+        if csv_results is not None:
+            # При смене файл откладывается, как и у основного
+            csv_results.set_question_ids(question_ids)
+
+
+# SQLite-хранилище (WAL, индексы по user_id и timestamp)
+class SqliteSubmissionStore(SubmissionStore):
+    def __init__(self, path="submissions.db"):
+        self.path = path
+        self.conn = None
+        self._lock = threading.Lock()
+
+    async def open(self):
+        await asyncio.to_thread(self._open)
+        return self
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS submissions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                username TEXT,
+                timestamp TEXT NOT NULL,
+                answers TEXT NOT NULL,
+                admin_response TEXT,
+                quiz_id TEXT NOT NULL DEFAULT 'default',
+                score TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_submissions_user ON submissions(user_id, id);
+            CREATE INDEX IF NOT EXISTS idx_submissions_timestamp ON submissions(timestamp);
+            CREATE INDEX IF NOT EXISTS idx_submissions_username ON submissions(username COLLATE NOCASE);
+        """)
+        # База, созданная до появления нескольких тестов
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(submissions)")}
+        if 'quiz_id' not in columns:
+            self.conn.execute(f"ALTER TABLE submissions ADD COLUMN quiz_id TEXT NOT NULL DEFAULT '{DEFAULT_QUIZ_ID}'")
+        if 'score' not in columns:
+            self.conn.execute("ALTER TABLE submissions ADD COLUMN score TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_submissions_quiz ON submissions(quiz_id, id)")
+        self._create_latest()
+        self.conn.commit()
+
+    # Последняя отправка каждого пользователя и её статус - отдельная таблица, которую ведут триггеры
+    # в той же транзакции, что и запись. Страницы браузера идут по её индексам, а число
+    # пользователей по фильтрам - из счётчиков latest_counts, без COUNT(*) и GROUP BY
+    def _create_latest(self):
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'latest'"
+        ).fetchone()
+        review = "(NEW.admin_response IS NULL AND COALESCE(json_extract(NEW.score, '$.review'), 0) = 1)"
+        counts = (
+            "UPDATE latest_counts SET total = total + {all}, answered = answered + {answered}, "
+            "pending = pending + {pending}, review = review + {review};"
+        )
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS latest (
+                user_id TEXT PRIMARY KEY,
+                submission_id INTEGER NOT NULL,
+                answered INTEGER NOT NULL,
+                review INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_latest_submission ON latest(submission_id);
+            CREATE INDEX IF NOT EXISTS idx_latest_answered ON latest(answered, submission_id);
+            CREATE INDEX IF NOT EXISTS idx_latest_review ON latest(review, submission_id);
+            CREATE TABLE IF NOT EXISTS latest_counts (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total INTEGER NOT NULL, answered INTEGER NOT NULL, pending INTEGER NOT NULL, review INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO latest_counts VALUES (0, 0, 0, 0, 0);
+
+            CREATE TRIGGER IF NOT EXISTS trg_latest_insert AFTER INSERT ON latest BEGIN
+                {counts.format(all="1", answered="NEW.answered", pending="1 - NEW.answered", review="NEW.review")}
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_latest_update AFTER UPDATE OF answered, review ON latest BEGIN
+                {counts.format(all="0", answered="NEW.answered - OLD.answered",
+                               pending="OLD.answered - NEW.answered", review="NEW.review - OLD.review")}
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_submissions_insert AFTER INSERT ON submissions BEGIN
+                INSERT INTO latest (user_id, submission_id, answered, review)
+                VALUES (NEW.user_id, NEW.id, NEW.admin_response IS NOT NULL, {review})
+                ON CONFLICT(user_id) DO UPDATE SET
+                    submission_id = excluded.submission_id, answered = excluded.answered, review = excluded.review;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_submissions_update AFTER UPDATE OF admin_response, score ON submissions BEGIN
+                UPDATE latest SET answered = NEW.admin_response IS NOT NULL, review = {review}
+                WHERE user_id = NEW.user_id AND submission_id = NEW.id;
+            END;
+        """)
+        if not exists:
+            # База, созданная до появления таблицы: заполняем один раз, счётчики считают триггеры
+            self.conn.execute("""
+                INSERT INTO latest (user_id, submission_id, answered, review)
+                SELECT user_id, id, admin_response IS NOT NULL,
+                       admin_response IS NULL AND COALESCE(json_extract(score, '$.review'), 0) = 1
+                FROM submissions WHERE id IN (SELECT MAX(id) FROM submissions GROUP BY user_id)
+            """)
+
+    async def close(self):
+        if self.conn is not None:
+            await asyncio.to_thread(self.conn.close)
+            self.conn = None
+
+    # Выполнение запроса в отдельном потоке
+    async def _run(self, func):
+        def call():
+            with self._lock:
+                return func(self.conn)
+        return await asyncio.to_thread(call)
+
+    @staticmethod
+    def _entry(row):
+        return {
+            "username": row['username'],
+            "timestamp": row['timestamp'],
+            "quiz_id": row['quiz_id'],
+            "answers": json.loads(row['answers']),
+            "admin_response": row['admin_response'],
+            "score": json.loads(row['score']) if row['score'] else None
+        }
+
+    async def add_many(self, items):
+        rows = [
+            (str(user_id), entry['username'], entry['timestamp'],
+             json.dumps(entry['answers'], ensure_ascii=False), entry.get('admin_response'), entry_quiz_id(entry),
+             json.dumps(entry['score']) if entry.get('score') else None)
+            for user_id, entry in items
+        ]
+
+        def insert(conn):
+            with storage_write_seconds.time("sqlite"), conn:
+                conn.executemany(
+                    "INSERT INTO submissions (user_id, username, timestamp, answers, admin_response, quiz_id, score) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+        await self._run(insert)
+
+    async def get_user(self, user_id):
+        def query(conn):
+            cursor = conn.execute("SELECT * FROM submissions WHERE user_id = ? ORDER BY id", (str(user_id),))
+            return [self._entry(row) for row in cursor]
+        return await self._run(query)
+
+    async def latest_by_user(self):
+        def query(conn):
+            cursor = conn.execute(
+                "SELECT s.* FROM latest l JOIN submissions s ON s.id = l.submission_id ORDER BY l.submission_id"
+            )
+            return {row['user_id']: self._entry(row) for row in cursor}
+        return await self._run(query)
+
+    def _counts(self, conn):
+        return dict(conn.execute("SELECT total, answered, pending, review FROM latest_counts").fetchone())
+
+    async def stats(self):
+        def query(conn):
+            counts = self._counts(conn)
+            submissions = conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+            return {"total_users": counts["total"], "answered": counts["answered"], "submissions": submissions}
+        return await self._run(query)
+
+    # Фильтр страницы -> (условие по latest, имя счётчика)
+    _PAGE_FILTERS = {
+        None: ("1", "total"),
+        "pending": ("l.answered = 0", "pending"),
+        "answered": ("l.answered = 1", "answered"),
+        "review": ("l.review = 1", "review")
+    }
+
+    async def latest_page(self, offset, limit, status=None, after=None, before=None):
+        if status not in self._PAGE_FILTERS:
+            raise ValueError(f"Неизвестный фильтр: {status}")
+        where, counter = self._PAGE_FILTERS[status]
+        select = "SELECT l.submission_id AS page_key, s.* FROM latest l JOIN submissions s ON s.id = l.submission_id"
+
+        def query(conn):
+            total = self._counts(conn)[counter]
+            if after is not None:
+                rows = conn.execute(
+                    f"{select} WHERE {where} AND l.submission_id > ? ORDER BY l.submission_id LIMIT ?", (after, limit)
+                ).fetchall()
+            elif before is not None:
+                rows = conn.execute(
+                    f"{select} WHERE {where} AND l.submission_id < ? ORDER BY l.submission_id DESC LIMIT ?",
+                    (before, limit)
+                ).fetchall()[::-1]
+            else:
+                rows = conn.execute(
+                    f"{select} WHERE {where} ORDER BY l.submission_id LIMIT ? OFFSET ?", (limit, offset)
+                ).fetchall()
+            keys = (rows[0]['page_key'], rows[-1]['page_key']) if rows else None
+            return total, [(row['user_id'], self._entry(row)) for row in rows], keys
+        return await self._run(query)
+
+    async def find_user(self, query):
+        query = str(query).strip().lstrip('@')
+
+        def lookup(conn):
+            row = conn.execute(
+                "SELECT * FROM submissions WHERE user_id = ? ORDER BY id DESC LIMIT 1", (query,)
+            ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    "SELECT * FROM submissions WHERE username = ? COLLATE NOCASE ORDER BY id DESC LIMIT 1", (query,)
+                ).fetchone()
+            return (row['user_id'], self._entry(row)) if row else None
+        return await self._run(lookup)
+
+    async def set_response(self, user_id, response):
+        def update(conn):
+            with storage_write_seconds.time("sqlite"), conn:
+                row = conn.execute(
+                    "SELECT * FROM submissions WHERE user_id = ? ORDER BY id DESC LIMIT 1", (str(user_id),)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE submissions SET admin_response = ? WHERE id = ?", (response, row['id']))
+            return dict(self._entry(row), admin_response=response)
+        return await self._run(update)
+
+    def iter_submissions(self, chunk_size=500, since=None, until=None):
+        # Keyset-пагинация: блокировка берётся только на время чтения одной пачки.
+        # С диапазоном дат идём по индексу timestamp, без него - по первичному ключу
+        ranged = since is not None or until is not None
+        last = (since or "", 0) if ranged else (0,)
+        while True:
+            with self._lock:
+                if ranged:
+                    rows = self.conn.execute(
+                        "SELECT * FROM submissions WHERE (timestamp, id) > (?, ?) AND timestamp < ? "
+                        "ORDER BY timestamp, id LIMIT ?",
+                        (*last, until or "\uffff", chunk_size)
+                    ).fetchall()
+                else:
+                    rows = self.conn.execute(
+                        "SELECT * FROM submissions WHERE id > ? ORDER BY id LIMIT ?", (*last, chunk_size)
+                    ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row['user_id'], self._entry(row)
+            last = (rows[-1]['timestamp'], rows[-1]['id']) if ranged else (rows[-1]['id'],)
+
+    # Курсор и ref - id строки
+    def iter_chunks(self, chunk_size=500, after=None):
+        last = after or 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT * FROM submissions WHERE id > ? ORDER BY id LIMIT ?", (last, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1]['id']
+            yield last, [(row['id'], row['user_id'], self._entry(row)) for row in rows]
+
+    async def set_scores(self, items):
+        rows = [(json.dumps(score) if score else None, ref) for ref, score in items]
+
+        def update(conn):
+            with storage_write_seconds.time("sqlite"), conn:
+                conn.executemany("UPDATE submissions SET score = ? WHERE id = ?", rows)
+        await self._run(update)
+
+    async def maintenance(self):
+        await self._run(lambda conn: conn.execute("PRAGMA wal_checkpoint(PASSIVE)"))
+
+
+# Создание хранилища по имени бэкенда (STORAGE_BACKEND)
+def create_store(backend="file", sqlite_path="submissions.db", question_ids=(1, 2, 3)):
+    if backend == "sqlite":
+        return SqliteSubmissionStore(sqlite_path)
+    if backend == "file":
+        return FileSubmissionStore(question_ids=question_ids)
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
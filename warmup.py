@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+# Прогрев после старта: то, что нужно только админ-панели и записи отправок,
+# строится в фоне, а бот тем временем уже отвечает пользователям
+class WarmUp(BaseMiddleware):
+    """Внешний middleware на dp.update: обновления от user_ids ждут окончания прогрева,
+    остальные проходят сразу"""
+
+    def __init__(self, user_ids=()):
+        self.user_ids = frozenset(user_ids)
+        self.duration = None
+        self._task = None
+
+    # steps - корутинные функции, выполняются по порядку; finally - выполняется в любом случае
+    def start(self, *steps, finally_=None):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(steps, finally_))
+        return self
+
+    async def _run(self, steps, finally_):
+        started = time.monotonic()
+        try:
+            for step in steps:
+                await step()
+        except Exception as e:
+            # Админ-панель останется без части данных, но отправки должны записываться
+            logger.error(f"Ошибка прогрева: {e}")
+        finally:
+            if finally_ is not None:
+                finally_()
+        self.duration = time.monotonic() - started
+        logger.info(f"Прогрев завершён за {self.duration:.2f} с")
+
+    @property
+    def ready(self):
+        return self._task is not None and self._task.done()
+
+    async def wait(self):
+        if self._task is not None:
+            # shield: отмена ожидающего обработчика не должна прерывать сам прогрев
+            await asyncio.shield(self._task)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None and user.id in self.user_ids and not self.ready:
+            await self.wait()
+        return await handler(event, data)
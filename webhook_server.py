@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import signal
+from contextlib import suppress
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+# Проверка живости для балансировщика
+def make_health_handler(health_info=None):
+    async def health(request):
+        payload = {"status": "ok"}
+        if health_info:
+            payload.update(health_info())
+        return web.json_response(payload)
+    return health
+
+
+# Запуск бота в режиме webhook на aiohttp-сервере
+async def run_webhook(bot, dp, base_url, path="/webhook", secret=None, host="0.0.0.0", port=8080,
+                      max_connections=40, shutdown_timeout=30, health_info=None):
+    """Каждый процесс поднимает свой сервер, несколько воркеров можно поставить за балансировщик"""
+    app = web.Application()
+    app.router.add_get("/health", make_health_handler(health_info))
+
+    # Порядок важен: shutdown диспетчера (сброс очередей) должен выполниться до закрытия сессии бота
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=False).register(app, path=path)
+
+    runner = web.AppRunner(app, shutdown_timeout=shutdown_timeout)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {host}:{port}{path}")
+
+    await bot.set_webhook(
+        url=base_url.rstrip('/') + path,
+        secret_token=secret,
+        max_connections=max_connections,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        # Перестаём принимать запросы, дожидаемся текущих обработчиков и закрываемся
+        logger.info("Остановка webhook-сервера...")
+        await runner.cleanup()
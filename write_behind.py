@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+
+from quiz import DEFAULT_QUIZ_ID
+from storage import make_entry
+
+logger = logging.getLogger(__name__)
+
+# Паузы между повторными попытками записи пачки, с
+RETRY_DELAYS = (0.5, 1, 2, 5, 10)
+
+
+# Фоновая запись завершённых тестов: пачками в хранилище + уведомление админу
+class SubmissionWriter:
+    """Ограниченная очередь отправок с воркером, который пишет их пачками.
+    Уведомления идут отдельной задачей и не задерживают запись"""
+
+    def __init__(self, store, notify=None, maxsize=1000, batch_size=50, prepare=None, saved=None,
+                 fallback_path="failed_submissions.jsonl", retry_delays=RETRY_DELAYS):
+        self.store = store
+        # async prepare(items) - обработка пачки перед записью (например, автоматическая оценка)
+        self.prepare = prepare
+        # saved(items) - синхронный, сразу после записи (индексы в памяти)
+        self.saved = saved
+        # async notify(items) - после записи, в отдельной задаче (уведомления админу)
+        self.notify = notify
+        self.batch_size = batch_size
+        # Пачка, которую не удалось записать и после всех повторов, дописывается сюда
+        self.fallback_path = fallback_path
+        self.retry_delays = retry_delays
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        # Записанные пачки, ждущие уведомления (без ограничения: отправки в них уже сохранены)
+        self.notifications = asyncio.Queue()
+        self._worker = None
+        self._notifier = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            self._notifier = asyncio.create_task(self._notify_loop())
+        return self
+
+    # Поставить отправку в очередь (ждёт, только если очередь переполнена)
+    async def submit(self, user_id, username, answers, mention=None, quiz_id=DEFAULT_QUIZ_ID, quiz_version=None):
+        item = {
+            "user_id": user_id,
+            "entry": make_entry(username, answers, quiz_id, quiz_version),
+            "mention": mention or username
+        }
+        await self.queue.put(item)
+        return item
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write(self, batch):
+        if self.prepare is not None:
+            try:
+                await self.prepare(batch)
+            except Exception as e:
+                # Без оценки отправка всё равно должна сохраниться
+                logger.error(f"Не удалось подготовить {len(batch)} отправок: {e}")
+        items = [(item['user_id'], item['entry']) for item in batch]
+        for attempt, delay in enumerate(self.retry_delays + (None,), start=1):
+            try:
+                await self.store.add_many(items)
+                break
+            except Exception as e:
+                if delay is None:
+                    logger.error(f"Не удалось сохранить {len(batch)} отправок после {attempt} попыток: {e}")
+                    await self._save_fallback(items)
+                    return
+                logger.warning(f"Не удалось сохранить {len(batch)} отправок (попытка {attempt}): {e}, повтор через {delay} с")
+                await asyncio.sleep(delay)
+
+        if self.saved is not None:
+            try:
+                self.saved(batch)
+            except Exception as e:
+                logger.error(f"Ошибка обработки записанных отправок: {e}")
+        if self.notify is not None:
+            self.notifications.put_nowait(batch)
+
+    # Последний шанс не потерять завершённые тесты: отдельный файл, который можно дозагрузить вручную
+    async def _save_fallback(self, items):
+        def write():
+            with open(self.fallback_path, 'a', encoding='utf-8') as f:
+                for user_id, entry in items:
+                    f.write(json.dumps(dict(entry, user_id=str(user_id)), ensure_ascii=False) + "\n")
+        try:
+            await asyncio.to_thread(write)
+            logger.error(f"{len(items)} отправок сохранено в {self.fallback_path}")
+        except OSError as e:
+            logger.critical(f"Потеряно {len(items)} отправок: не удалось записать и {self.fallback_path}: {e}")
+
+    async def _notify_loop(self):
+        while True:
+            batch = await self.notifications.get()
+            try:
+                await self.notify(batch)
+            except Exception as e:
+                logger.error(f"Не удалось отправить уведомление админу: {e}")
+            finally:
+                self.notifications.task_done()
+
+    # Дописать всё, что осталось в очереди, разослать уведомления и остановить воркеры
+    async def stop(self, timeout=10):
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Очередь записи не опустела за {timeout} с, потеряно отправок: {self.queue.qsize()}")
+        try:
+            await asyncio.wait_for(self.notifications.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не разосланы уведомления о {self.notifications.qsize()} пачках")
+        for task in (self._worker, self._notifier):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker = self._notifier = None